@@ -18,9 +18,11 @@ python manage.py collectstatic --noinput
 
 echo "📋 Накатываем миграции..."
 python manage.py migrate
+python manage.py createcachetable
 
 echo "🔁 Перезапускаем сервис star-burger.service..."
 sudo systemctl restart star-burger
+sudo systemctl restart star-burger-geocoder
 
 echo "🌍 Загружаем переменные окружения..."
 # Защита от пробелов и переносов строк
@@ -1,12 +1,16 @@
 from urllib.parse import urlencode
 
+from django import forms
 from django.contrib import admin
 from django.shortcuts import redirect, reverse
 from django.templatetags.static import static
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.http import url_has_allowed_host_and_scheme
 
-from .models import Order, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem, Location
+from .models import Banner, GeocodeTask, Order, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem, Location
+from .services.assignment import apply_assignment, propose_assignment
+from .services.distance_cache import invalidate_location_distances
 
 
 class OrderItemInline(admin.TabularInline):
@@ -20,9 +24,69 @@ class OrderItemInline(admin.TabularInline):
 class LocationAdmin(admin.ModelAdmin):
     list_display = ['address' ,'lat', 'lon']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and {'lat', 'lon'} & set(form.changed_data):
+            invalidate_location_distances(obj)
+
+
+@admin.register(GeocodeTask)
+class GeocodeTaskAdmin(admin.ModelAdmin):
+    list_display = ['address', 'status', 'attempts', 'run_after', 'last_error']
+    list_filter = ['status']
+    search_fields = ['address']
+
+
+class OrderAdminForm(forms.ModelForm):
+    seen_version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['seen_version'].initial = self.instance.version
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not self.instance.pk:
+            return cleaned_data
+        # The admin saves inside a transaction, so the row stays locked
+        # until this form is saved
+        current_version = (
+            Order.objects.select_for_update()
+            .filter(pk=self.instance.pk)
+            .values_list('version', flat=True)
+            .first()
+        )
+        if current_version != cleaned_data.get('seen_version'):
+            raise forms.ValidationError(
+                'Заказ изменил другой менеджер, пока вы его редактировали. '
+                'Обновите страницу и проверьте изменения.'
+            )
+        self.instance.version = current_version
+        return cleaned_data
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     inlines = [OrderItemInline, ]
+    actions = ['assign_nearest_restaurants']
+    readonly_fields = ['claimed_at']
+
+    def save_model(self, request, obj, form, change):
+        if 'restaurant' in form.changed_data and obj.restaurant:
+            obj.manager = request.user
+            obj.claimed_at = timezone.now()
+        super().save_model(request, obj, form, change)
+
+    def assign_nearest_restaurants(self, request, queryset):
+        assigned_orders = apply_assignment(propose_assignment(queryset), request.user)
+        self.message_user(request, f'Назначено ресторанов: {len(assigned_orders)}')
+    assign_nearest_restaurants.short_description = 'Распределить по ближайшим ресторанам'
+
     def response_change(self, request, obj):
         next_url = request.GET.get('next')
         if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
@@ -63,12 +127,14 @@ class ProductAdmin(admin.ModelAdmin):
         'name',
         'category',
         'price',
+        'available_restaurants_count',
     ]
     list_display_links = [
         'name',
     ]
     list_filter = [
         'category',
+        'available_anywhere',
     ]
     search_fields = [
         # FIXME SQLite can not convert letter case for cyrillic words properly, so search will be buggy.
@@ -115,14 +181,61 @@ class ProductAdmin(admin.ModelAdmin):
     def get_image_preview(self, obj):
         if not obj.image:
             return 'выберите картинку'
-        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.get_image_url('card'))
     get_image_preview.short_description = 'превью'
 
     def get_image_list_preview(self, obj):
         if not obj.image or not obj.id:
             return 'нет картинки'
         edit_url = reverse('admin:foodcartapp_product_change', args=(obj.id,))
-        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=obj.image.url)
+        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=obj.thumbnail_url)
+    get_image_list_preview.short_description = 'превью'
+
+
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = [
+        'get_image_list_preview',
+        'title',
+        'order',
+        'is_active',
+        'active_from',
+        'active_until',
+    ]
+    list_display_links = [
+        'title',
+    ]
+    list_editable = [
+        'order',
+        'is_active',
+    ]
+    list_filter = [
+        'is_active',
+    ]
+    fields = [
+        'title',
+        'text',
+        'image',
+        'get_image_preview',
+        'order',
+        'is_active',
+        'active_from',
+        'active_until',
+    ]
+    readonly_fields = [
+        'get_image_preview',
+    ]
+
+    def get_image_preview(self, obj):
+        if not obj.image:
+            return 'выберите картинку'
+        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+    get_image_preview.short_description = 'превью'
+
+    def get_image_list_preview(self, obj):
+        if not obj.image:
+            return 'нет картинки'
+        return format_html('<img src="{src}" style="max-height: 50px;"/>', src=obj.image.url)
     get_image_list_preview.short_description = 'превью'
 
 
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.services.assignment import apply_assignment, propose_assignment
+
+
+class Command(BaseCommand):
+    help = 'Подбирает рестораны всем необработанным заказам с минимальной суммой расстояний'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--apply',
+            action='store_true',
+            help='сохранить назначения, а не только показать их',
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        proposals = propose_assignment()
+        elapsed = time.perf_counter() - started_at
+
+        for order, restaurant, km in proposals:
+            self.stdout.write(f'Заказ #{order.id} → {restaurant.name}, {km:.2f} км')
+        total_km = sum(km for _, _, km in proposals)
+        self.stdout.write(
+            f'Распределено заказов: {len(proposals)}, '
+            f'суммарно {total_km:.2f} км, расчёт занял {elapsed:.3f} с'
+        )
+
+        if options['apply']:
+            assigned_orders = apply_assignment(proposals)
+            self.stdout.write(self.style.SUCCESS(
+                f'Сохранено назначений: {len(assigned_orders)}'
+            ))
@@ -0,0 +1,77 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from foodcartapp.models import Product, invalidate_menu_caches
+from foodcartapp.services.images import delete_all_unused_variants, make_image_variants
+
+
+def make_variants(image_name):
+    """Runs in a pool process, which only touches the files, not the database."""
+    try:
+        return image_name, make_image_variants(image_name), None
+    except OSError as error:
+        return image_name, None, str(error)
+
+
+class Command(BaseCommand):
+    help = (
+        'Делает уменьшенные WebP и JPEG копии картинок товаров, у которых их ещё нет, '
+        'и удаляет копии, которые больше ни к чему'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='сколько процессов обрабатывают картинки, по умолчанию — по числу ядер',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='переделать копии всех картинок, даже готовые',
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        products = [
+            product for product in Product.objects.exclude(image='').only('id', 'image', 'image_variants')
+            if options['force'] or not product.has_image_variants
+        ]
+        product_ids_by_image = {}
+        for product in products:
+            product_ids_by_image.setdefault(product.image.name, []).append(product.id)
+        self.stdout.write(f'Товаров без копий картинок: {len(products)}, картинок: {len(product_ids_by_image)}')
+        if product_ids_by_image:
+            self.backfill(product_ids_by_image, options['workers'], started_at)
+        deleted_count = delete_all_unused_variants()
+        self.stdout.write(f'Удалено ненужных копий: {deleted_count}')
+
+    def backfill(self, product_ids_by_image, workers, started_at):
+        # Forked processes must not share the parent's database connections
+        connections.close_all()
+        done_count = failed_count = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(make_variants, image_name) for image_name in product_ids_by_image]
+            for future in as_completed(futures):
+                image_name, image_variants, error = future.result()
+                if error:
+                    failed_count += 1
+                    self.stderr.write(f'{image_name}: {error}')
+                    continue
+                # Only if the image wasn't replaced meanwhile
+                Product.objects.filter(
+                    id__in=product_ids_by_image[image_name],
+                    image=image_name,
+                ).update(image_variants=image_variants)
+                done_count += 1
+
+        invalidate_menu_caches()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started_at:.1f} с: '
+            f'картинок обработано {done_count}, с ошибками {failed_count}'
+        ))
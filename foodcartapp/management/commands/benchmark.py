@@ -0,0 +1,265 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from foodcartapp.models import (
+    Location,
+    Order,
+    OrderItem,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from foodcartapp.services.addresses import normalize_address
+from foodcartapp.services.availability import invalidate_availability_index
+from foodcartapp.services.catalog import invalidate_catalog
+from foodcartapp.services.distance_cache import fill_order_distances
+from foodcartapp.services.spatial import invalidate_spatial_index
+
+
+BATCH_SIZE = 5000
+# Around Moscow, where the real restaurants are
+CITY_CENTER = (55.75, 37.62)
+CITY_SPREAD_DEGREES = 0.25
+OPEN_ORDERS_SHARE = 0.2
+ORDER_STATUSES = ['raw', 'in_progress', 'in_delivery']
+
+
+def bulk_create(model, objects):
+    """bulk_create that sets primary keys on backends not returning them."""
+    objects = model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    if objects and objects[0].pk is None:
+        # The database is ours alone, so the new rows are the last ones
+        new_ids = (
+            model.objects.order_by('-pk')
+            .values_list('pk', flat=True)[:len(objects)]
+        )
+        for obj, pk in zip(objects, reversed(new_ids)):
+            obj.pk = pk
+    return objects
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время, число запросов к БД и пик памяти основных страниц '
+        'и API на синтетических данных во временной тестовой базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--orders',
+            type=int,
+            nargs='+',
+            default=[1000, 10000, 100000],
+            help='сколько заказов создать для каждого замера',
+        )
+        parser.add_argument('--restaurants', type=int, default=20)
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument(
+            '--locations',
+            type=int,
+            default=1000,
+            help='сколько разных адресов доставки у заказов',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='сколько раз повторить каждый запрос, время — медиана',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        setup_test_environment()
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.run_benchmarks(options)
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            teardown_test_environment()
+            # The shared cache now holds the catalog of the test database
+            invalidate_catalog()
+
+    def run_benchmarks(self, options):
+        self.seed_catalog(options['restaurants'], options['products'], options['locations'])
+        client = Client()
+        client.force_login(User.objects.create_user('benchmark', is_staff=True))
+
+        self.stdout.write(
+            f'{"заказов":>8}  {"запрос":<16} {"медиана, мс":>12} {"мин, мс":>9} '
+            f'{"запросов БД":>12} {"пик памяти, КиБ":>16}'
+        )
+        for orders_count in sorted(options['orders']):
+            self.seed_orders(orders_count - Order.objects.count())
+            for name, request in self.get_requests():
+                timings, queries_count, peak_memory = self.measure(
+                    client, request, options['repeat'],
+                )
+                self.stdout.write(
+                    f'{orders_count:>8}  {name:<16} '
+                    f'{statistics.median(timings) * 1000:>12.1f} '
+                    f'{min(timings) * 1000:>9.1f} '
+                    f'{queries_count:>12} {peak_memory / 1024:>16.0f}'
+                )
+
+    def get_requests(self):
+        product_ids = list(Product.objects.available().values_list('id', flat=True)[:3])
+        order_payload = json.dumps({
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79291000000',
+            # Already geocoded, so no calls to the geocoder are made
+            'address': self.addresses[0],
+            'products': [
+                {'product': product_id, 'quantity': 1} for product_id in product_ids
+            ],
+        })
+        return [
+            ('view_orders', lambda client: client.get('/manager/orders/')),
+            ('view_products', lambda client: client.get('/manager/products/')),
+            ('product_list_api', lambda client: client.get('/api/products/')),
+            ('register_order', lambda client: client.post(
+                '/api/order/', order_payload, content_type='application/json',
+            )),
+        ]
+
+    def measure(self, client, request, repeat):
+        timings = []
+        for _ in range(repeat):
+            # Django resets connection.queries on every request, so queries
+            # are counted with a wrapper instead
+            query_counter = QueryCounter()
+            with connection.execute_wrapper(query_counter):
+                started_at = time.perf_counter()
+                response = request(client)
+                timings.append(time.perf_counter() - started_at)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{response.status_code}: {response.content[:500]}')
+
+        # Tracing slows everything down, so memory is measured in a separate run
+        tracemalloc.start()
+        try:
+            request(client)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return timings, query_counter.count, peak_memory
+
+    def get_random_point(self):
+        lat, lon = CITY_CENTER
+        return (
+            lat + self.random.uniform(-CITY_SPREAD_DEGREES, CITY_SPREAD_DEGREES),
+            lon + self.random.uniform(-CITY_SPREAD_DEGREES, CITY_SPREAD_DEGREES),
+        )
+
+    def seed_catalog(self, restaurants_count, products_count, locations_count):
+        categories = bulk_create(ProductCategory, [
+            ProductCategory(name=f'Категория {number}') for number in range(10)
+        ])
+        products = bulk_create(Product, [
+            Product(
+                name=f'Товар {number}',
+                category=self.random.choice(categories),
+                price=Decimal(self.random.randrange(100, 1000)),
+                image='benchmark.png',
+                special_status=not number % 10,
+                description='Описание товара',
+            )
+            for number in range(products_count)
+        ])
+
+        restaurant_locations = bulk_create(Location, [
+            Location(
+                address=f'Ресторан, {number}',
+                address_key=normalize_address(f'Ресторан, {number}'),
+                lat=lat,
+                lon=lon,
+            )
+            for number, (lat, lon) in enumerate(
+                self.get_random_point() for _ in range(restaurants_count)
+            )
+        ])
+        restaurants = bulk_create(Restaurant, [
+            Restaurant(name=f'Ресторан {number}', address=location.address, location=location)
+            for number, location in enumerate(restaurant_locations)
+        ])
+        bulk_create(RestaurantMenuItem, [
+            RestaurantMenuItem(
+                restaurant=restaurant,
+                product=product,
+                availability=self.random.random() < 0.9,
+            )
+            for restaurant in restaurants
+            for product in products
+            if self.random.random() < 0.8
+        ])
+
+        order_locations = bulk_create(Location, [
+            Location(
+                address=f'Доставка, {number}',
+                address_key=normalize_address(f'Доставка, {number}'),
+                lat=lat,
+                lon=lon,
+            )
+            for number, (lat, lon) in enumerate(
+                self.get_random_point() for _ in range(locations_count)
+            )
+        ])
+        # bulk_create skips the signals keeping these up to date
+        invalidate_availability_index()
+        invalidate_catalog()
+        invalidate_spatial_index()
+        fill_order_distances(order_locations)
+
+        self.products = products
+        self.order_locations = order_locations
+        self.addresses = [location.address for location in order_locations]
+
+    def seed_orders(self, orders_count):
+        registered_at = timezone.now() - timedelta(days=30)
+        for batch_start in range(0, max(orders_count, 0), BATCH_SIZE):
+            orders = []
+            for _ in range(min(BATCH_SIZE, orders_count - batch_start)):
+                location = self.random.choice(self.order_locations)
+                status = 'completed'
+                if self.random.random() < OPEN_ORDERS_SHARE:
+                    status = self.random.choice(ORDER_STATUSES)
+                orders.append(Order(
+                    firstname='Иван',
+                    lastname='Петров',
+                    phonenumber='+79291000000',
+                    address=location.address,
+                    location=location,
+                    status=status,
+                    payment_method=self.random.choice(Order.PAYMENT_METHOD)[0],
+                    registered_at=registered_at,
+                ))
+            orders = bulk_create(Order, orders)
+            bulk_create(OrderItem, [
+                OrderItem(order=order, product=product, quantity=1, price=product.price)
+                for order in orders
+                for product in self.random.sample(self.products, 3)
+            ])
@@ -0,0 +1,75 @@
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+from foodcartapp.renderers import FastJSONRenderer
+
+
+def get_catalog_data(products_count, random_generator):
+    """Product list as /api/products/ returns it, without a database."""
+    categories = [{'id': number, 'name': f'Категория {number}'} for number in range(10)]
+    return [
+        {
+            'id': number,
+            'name': f'Товар {number}',
+            'price': Decimal(random_generator.randrange(10000, 100000)) / 100,
+            'special_status': not number % 10,
+            'description': 'Сочная котлета, свежие овощи и фирменный соус. ' * 3,
+            'category': random_generator.choice(categories),
+            'image': f'/media/product_{number}.png',
+            'restaurant': {'id': number, 'name': f'Товар {number}'},
+        }
+        for number in range(products_count)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость сериализации каталога товаров в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='сколько раз сериализовать каталог, время — медиана',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        data = get_catalog_data(options['products'], random.Random(options['seed']))
+        serializers = [
+            ('json, indent=4 (как было)', lambda: json.dumps(
+                data, cls=DjangoJSONEncoder, ensure_ascii=False, indent=4,
+            ).encode()),
+            ('json, компактный', lambda: json.dumps(
+                data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'),
+            ).encode()),
+            ('DRF JSONRenderer', lambda: JSONRenderer().render(data)),
+            ('FastJSONRenderer (orjson)', lambda: FastJSONRenderer().render(data)),
+        ]
+
+        self.stdout.write(f'Товаров: {options["products"]}')
+        self.stdout.write(
+            f'{"сериализатор":<28} {"медиана, мс":>12} {"мин, мс":>9} '
+            f'{"размер, КиБ":>12} {"ускорение":>10}'
+        )
+        baseline = None
+        for name, serialize in serializers:
+            timings = []
+            for _ in range(options['repeat']):
+                started_at = time.perf_counter()
+                content = serialize()
+                timings.append(time.perf_counter() - started_at)
+            median = statistics.median(timings)
+            baseline = baseline or median
+            self.stdout.write(
+                f'{name:<28} {median * 1000:>12.1f} {min(timings) * 1000:>9.1f} '
+                f'{len(content) / 1024:>12.0f} {baseline / median:>9.1f}×'
+            )
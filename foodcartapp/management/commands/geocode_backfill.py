@@ -0,0 +1,107 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.services.geocode_backfill import (
+    geocode_many,
+    get_known_locations,
+    get_recent_misses,
+    get_unlocated_addresses,
+    save_locations,
+)
+from foodcartapp.services.geocode_cache import remember_miss
+from foodcartapp.services.geocode_metrics import flush
+
+
+class Command(BaseCommand):
+    help = (
+        'Определяет координаты всех заказов и ресторанов без них. '
+        'Прогресс сохраняется после каждой пачки, прерванный запуск можно продолжить'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='сколько запросов к геокодеру делать одновременно',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=10,
+            help='не больше стольких запросов к геокодеру в секунду, 0 — без ограничений',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='после скольких адресов сохранять результаты',
+        )
+        parser.add_argument(
+            '--retry-missing',
+            action='store_true',
+            help='снова искать адреса, которые геокодер недавно не нашёл',
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        unlocated_addresses = get_unlocated_addresses()
+        address_keys = list(unlocated_addresses)
+        known_locations = get_known_locations(address_keys)
+
+        # Some addresses were geocoded already, just not linked
+        known_coords = {
+            address_key: location.coords
+            for address_key, location in known_locations.items()
+            if location.coords
+        }
+        if known_coords:
+            save_locations(unlocated_addresses, known_coords, known_locations)
+        pending_keys = [key for key in address_keys if key not in known_coords]
+        skipped_keys = set()
+        if not options['retry_missing']:
+            skipped_keys = get_recent_misses(pending_keys)
+            pending_keys = [key for key in pending_keys if key not in skipped_keys]
+
+        self.stdout.write(
+            f'Адресов без координат: {len(address_keys)}, уже известны: {len(known_coords)}, '
+            f'недавно не найдены: {len(skipped_keys)}, осталось определить: {len(pending_keys)}'
+        )
+
+        found_count = missing_count = failed_count = 0
+        batch_size = options['batch_size']
+        try:
+            for batch_start in range(0, len(pending_keys), batch_size):
+                batch_keys = pending_keys[batch_start:batch_start + batch_size]
+                results = geocode_many(
+                    [unlocated_addresses[key].address for key in batch_keys],
+                    options['workers'],
+                    options['rate'],
+                )
+                coords_by_key = {}
+                for address_key, (address, result) in zip(batch_keys, results):
+                    if isinstance(result, Exception):
+                        failed_count += 1
+                        self.stderr.write(f'{address}: {result}')
+                    elif result is None:
+                        missing_count += 1
+                        remember_miss(address)
+                    else:
+                        coords_by_key[address_key] = result
+                save_locations(unlocated_addresses, coords_by_key, known_locations)
+                found_count += len(coords_by_key)
+                self.stdout.write(
+                    f'Обработано {batch_start + len(batch_keys)} из {len(pending_keys)}: '
+                    f'найдено {found_count}, не найдено {missing_count}, ошибок {failed_count}'
+                )
+        except KeyboardInterrupt:
+            self.stdout.write('Прервано, сохранённое не пропадёт — запустите команду снова')
+            return
+        finally:
+            # The geocoder counters of the run show up in geocode_stats
+            flush()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started_at:.1f} с'
+        ))
@@ -0,0 +1,103 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from foodcartapp.services.geocode_metrics import get_metrics, reset_metrics
+
+
+PROCESS_LOCAL_CACHES = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+OUTCOME_TITLES = {
+    'found': 'найдено',
+    'not_found': 'не найдено',
+    'timeout': 'таймаут',
+    'unavailable': 'недоступен',
+    'circuit_open': 'запросы приостановлены',
+    'quota_exceeded': 'превышена квота',
+    'auth_failed': 'ошибка ключа',
+    'parse_error': 'непонятный ответ',
+    'http_error': 'ошибка HTTP',
+}
+
+
+def format_ms(value):
+    return '—' if value is None else f'{value} мс'
+
+
+def format_latency(latency):
+    if not latency['count']:
+        return 'нет замеров'
+    return (
+        f'замеров {latency["count"]}, в среднем {format_ms(latency["avg_ms"])}, '
+        f'p50 ≤ {format_ms(latency["p50_ms"])}, p95 ≤ {format_ms(latency["p95_ms"])}, '
+        f'p99 ≤ {format_ms(latency["p99_ms"])}'
+    )
+
+
+class Command(BaseCommand):
+    help = 'Показывает счётчики геокодирования всех процессов и очередь адресов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='вывести в JSON, как отдаёт /manager/geocoding/metrics/',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='обнулить счётчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        if settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+            self.stderr.write(self.style.WARNING(
+                'CACHE_URL указывает на кэш в памяти процесса, счётчики других процессов не видны'
+            ))
+        metrics = get_metrics()
+        if options['json']:
+            self.stdout.write(json.dumps(metrics, ensure_ascii=False, indent=2))
+        else:
+            self.write_metrics(metrics)
+        if options['reset']:
+            reset_metrics()
+
+    def write_metrics(self, metrics):
+        self.stdout.write(f'Поиск адреса при оформлении заказа: {format_latency(metrics["checkout"])}')
+
+        lookups = metrics['lookups']
+        hit_ratio = lookups['hit_ratio']
+        self.stdout.write(
+            f'Кэш координат: из памяти {lookups["local_hits"]}, из общего кэша {lookups["shared_hits"]}, '
+            f'из базы {lookups["db_hits"]}, недавно не найдены {lookups["missing_hits"]}, '
+            f'промахи {lookups["misses"]}, доля попаданий '
+            f'{"—" if hit_ratio is None else f"{hit_ratio:.1%}"}'
+        )
+
+        for backend, geocoder in metrics['geocoders'].items():
+            outcomes = ', '.join(
+                f'{OUTCOME_TITLES[outcome]} {count}'
+                for outcome, count in geocoder['outcomes'].items()
+                if count
+            )
+            self.stdout.write(
+                f'Геокодер {backend}: запросов {geocoder["calls"]}'
+                + (f' ({outcomes})' if outcomes else '')
+            )
+            self.stdout.write(f'  время ответа: {format_latency(geocoder["latency"])}')
+
+        tasks = metrics['tasks']
+        queue = metrics['queue']
+        oldest = queue['oldest_pending_seconds']
+        self.stdout.write(
+            f'Очередь: ждут {queue["pending"]}, из них пора обработать {queue["due"]}, '
+            f'не найдены {queue["failed"]}, самый старый ждёт '
+            f'{"—" if oldest is None else f"{oldest} с"}'
+        )
+        self.stdout.write(
+            f'Воркер: найдено {tasks["done"]}, отложено {tasks["retried"]}, не найдено {tasks["failed"]}'
+        )
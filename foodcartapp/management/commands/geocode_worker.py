@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from foodcartapp.services.distance_cache import fill_pending_distances
+from foodcartapp.services.geocode_metrics import start_flushing
+from foodcartapp.services.geocoding_queue import claim_tasks, run_task
+
+
+class Command(BaseCommand):
+    help = (
+        'Определяет координаты адресов новых заказов в фоне '
+        'и запоминает расстояния от них до ресторанов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='сколько адресов брать из очереди за раз',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1,
+            help='сколько секунд ждать, когда очередь пуста',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='разобрать очередь и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        start_flushing()
+        try:
+            while True:
+                tasks = claim_tasks(options['batch_size'])
+                if not tasks:
+                    # Geocoding goes first, distances wait for an idle moment
+                    filled_count = fill_pending_distances()
+                    if filled_count:
+                        self.stdout.write(f'Расстояния до ресторанов посчитаны для адресов: {filled_count}')
+                        continue
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                for task in tasks:
+                    if run_task(task):
+                        self.stdout.write(f'{task.address}: найден')
+                    elif task.status == 'pending':
+                        self.stderr.write(
+                            f'{task.address}: {task.last_error}, '
+                            f'повтор не раньше {timezone.localtime(task.run_after):%H:%M:%S}'
+                        )
+                    else:
+                        self.stderr.write(f'{task.address}: {task.last_error}')
+        except KeyboardInterrupt:
+            pass
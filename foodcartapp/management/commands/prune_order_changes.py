@@ -0,0 +1,24 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from foodcartapp.models import OrderChange
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые записи журнала изменений заказов, по которому обновляется список заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.ORDER_CHANGES_RETENTION_DAYS,
+            help='сколько дней хранить изменения, по умолчанию — ORDER_CHANGES_RETENTION_DAYS',
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted_count = OrderChange.objects.prune(before)
+        self.stdout.write(self.style.SUCCESS(f'Удалено изменений: {deleted_count}'))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+
+from foodcartapp.models import Product, invalidate_menu_caches
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет, в скольких ресторанах продаётся каждый товар, с меню ресторанов '
+        'и исправляет расхождения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='только показать расхождения, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        drifted_products = list(
+            Product.objects
+            .annotate(
+                actual_count=Count('menu_items', filter=Q(menu_items__availability=True)),
+            )
+            .filter(
+                ~Q(available_restaurants_count=F('actual_count'))
+                | Q(available_anywhere=True, actual_count=0)
+                | Q(available_anywhere=False, actual_count__gt=0)
+            )
+            .order_by('id')
+        )
+        for product in drifted_products:
+            self.stdout.write(
+                f'{product.name} (id {product.id}): записано {product.available_restaurants_count}, '
+                f'на самом деле {product.actual_count}'
+            )
+        if not drifted_products:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        if options['dry_run']:
+            self.stdout.write(f'Расхождений: {len(drifted_products)}')
+            return
+
+        product_ids = [product.id for product in drifted_products]
+        for batch_start in range(0, len(product_ids), BATCH_SIZE):
+            Product.objects.filter(
+                id__in=product_ids[batch_start:batch_start + BATCH_SIZE],
+            ).recount_availability()
+        invalidate_menu_caches()
+        self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {len(drifted_products)}'))
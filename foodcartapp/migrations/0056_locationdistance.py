@@ -0,0 +1,28 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0055_order_status_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationDistance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('km', models.FloatField(verbose_name='расстояние, км')),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distances_to', to='foodcartapp.location', verbose_name='куда')),
+                ('origin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distances_from', to='foodcartapp.location', verbose_name='откуда')),
+            ],
+            options={
+                'verbose_name': 'расстояние',
+                'verbose_name_plural': 'расстояния',
+                'unique_together': {('origin', 'destination')},
+            },
+        ),
+    ]
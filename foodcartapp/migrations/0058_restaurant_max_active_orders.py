@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0057_orderchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='max_active_orders',
+            field=models.PositiveIntegerField(blank=True, help_text='Пусто — без ограничений', null=True, verbose_name='макс. заказов на сборке'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0059_order_claims'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=255, unique=True, verbose_name='адрес')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('done', 'Выполнено'), ('failed', 'Адрес не найден')], default='pending', max_length=20, verbose_name='статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='попыток')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='не раньше')),
+                ('last_error', models.TextField(blank=True, verbose_name='последняя ошибка')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='создано')),
+            ],
+            options={
+                'verbose_name': 'задача геокодирования',
+                'verbose_name_plural': 'задачи геокодирования',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='geocodetask',
+            index=models.Index(fields=['status', 'run_after'], name='geocodetask_status_run_idx'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+import re
+from collections import defaultdict
+
+from django.db import migrations
+
+
+# A copy of services.addresses.normalize_address as this migration shipped
+# with it, so later changes to the normalizer don't change what it did.
+# It still reads «пр» as «проспект», 0068 makes the keys again without it.
+NOISE_WORDS = {'г', 'гор', 'город', 'д', 'дом'}
+
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'наб': 'набережная',
+    'туп': 'тупик',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'кв': 'квартира',
+}
+
+SEPARATORS_RE = re.compile(r'[^\w/-]+|(?<!\w)[/-]|[/-](?!\w)|_')
+
+
+def normalize_address(address):
+    words = SEPARATORS_RE.sub(' ', address.casefold().replace('ё', 'е')).split()
+    return ' '.join(
+        ABBREVIATIONS.get(word, word) for word in words if word not in NOISE_WORDS
+    )
+
+
+def merge_duplicate_locations(apps, schema_editor):
+    Location = apps.get_model('foodcartapp', 'Location')
+    LocationDistance = apps.get_model('foodcartapp', 'LocationDistance')
+    Order = apps.get_model('foodcartapp', 'Order')
+    Restaurant = apps.get_model('foodcartapp', 'Restaurant')
+
+    locations_by_key = defaultdict(list)
+    for location in Location.objects.order_by('id'):
+        location.address_key = normalize_address(location.address)
+        locations_by_key[location.address_key].append(location)
+
+    kept_locations = []
+    for locations in locations_by_key.values():
+        # The oldest geocoded one stays, the rest are merged into it
+        locations.sort(key=lambda location: (location.lat is None or location.lon is None, location.id))
+        kept_location, *duplicates = locations
+        kept_locations.append(kept_location)
+        duplicate_ids = [location.id for location in duplicates]
+        if duplicate_ids:
+            Order.objects.filter(location_id__in=duplicate_ids).update(location=kept_location)
+            Restaurant.objects.filter(location_id__in=duplicate_ids).update(location=kept_location)
+            for field in ['origin', 'destination']:
+                other_field = 'destination' if field == 'origin' else 'origin'
+                known_ids = set(
+                    LocationDistance.objects
+                    .filter(**{field: kept_location})
+                    .values_list(f'{other_field}_id', flat=True)
+                )
+                for distance in LocationDistance.objects.filter(**{f'{field}_id__in': duplicate_ids}):
+                    other_id = getattr(distance, f'{other_field}_id')
+                    if other_id in known_ids or other_id in duplicate_ids:
+                        distance.delete()
+                        continue
+                    setattr(distance, f'{field}_id', kept_location.id)
+                    distance.save()
+                    known_ids.add(other_id)
+            Location.objects.filter(id__in=duplicate_ids).delete()
+    Location.objects.bulk_update(kept_locations, ['address_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0061_location_address_key'),
+    ]
+
+    operations = [
+        # Merged locations are deleted and can't be told apart again, rolling
+        # back leaves them merged and 0061 drops the keys
+        migrations.RunPython(merge_duplicate_locations, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0062_merge_duplicate_locations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='location',
+            name='address_key',
+            field=models.CharField(editable=False, max_length=255, unique=True, verbose_name='нормализованный адрес'),
+        ),
+    ]
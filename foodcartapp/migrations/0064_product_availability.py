@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:46
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_product_availability(apps, schema_editor):
+    Product = apps.get_model('foodcartapp', 'Product')
+    products = Product.objects.annotate(
+        available_count=Count('menu_items', filter=Q(menu_items__availability=True)),
+    )
+    for product in products:
+        product.available_restaurants_count = product.available_count
+        product.available_anywhere = product.available_count > 0
+    Product.objects.bulk_update(
+        products,
+        ['available_restaurants_count', 'available_anywhere'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0063_location_address_key_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_anywhere',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='есть в продаже'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='available_restaurants_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='в скольких ресторанах в продаже'),
+        ),
+        migrations.RunPython(count_product_availability, reverse_code=migrations.RunPython.noop),
+    ]
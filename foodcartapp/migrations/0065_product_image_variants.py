@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0064_product_availability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, verbose_name='уменьшенные копии картинки'),
+        ),
+    ]
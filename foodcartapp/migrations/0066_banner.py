@@ -0,0 +1,77 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:52
+
+from django.contrib.staticfiles import finders
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+# The banners that were hardcoded in banners_list_api
+BANNERS = [
+    ('Burger', 'burger.jpg', 'Tasty Burger at your door step'),
+    ('Spices', 'food.jpg', 'All Cuisines'),
+    ('New York', 'tasty.jpg', 'Food is incomplete without a tasty dessert'),
+]
+
+
+def is_stored(storage, name, content):
+    if not storage.exists(name):
+        return False
+    with storage.open(name, 'rb') as stored_file:
+        return stored_file.read() == content
+
+
+def add_banners(apps, schema_editor):
+    Banner = apps.get_model('foodcartapp', 'Banner')
+    storage = Banner._meta.get_field('image').storage
+    for order, (title, image_name, text) in enumerate(BANNERS):
+        image_path = finders.find(image_name)
+        if not image_path:
+            raise FileNotFoundError(f'Картинка баннера {image_name} не найдена в статике')
+        with open(image_path, 'rb') as image_file:
+            content = image_file.read()
+        # Migrations run again for every test database, the copy made
+        # the first time is reused instead of adding one more
+        name = f'banners/{image_name}'
+        if not is_stored(storage, name, content):
+            name = storage.save(name, ContentFile(content))
+        Banner.objects.create(title=title, text=text, order=order, image=name)
+
+
+def delete_banners(apps, schema_editor):
+    Banner = apps.get_model('foodcartapp', 'Banner')
+    storage = Banner._meta.get_field('image').storage
+    banners = Banner.objects.filter(title__in=[title for title, _, _ in BANNERS])
+    image_names = {banner.image.name for banner in banners}
+    banners.delete()
+    used_names = set(Banner.objects.filter(image__in=image_names).values_list('image', flat=True))
+    for name in image_names - used_names:
+        storage.delete(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0065_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Banner',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=50, verbose_name='заголовок')),
+                ('text', models.CharField(blank=True, max_length=200, verbose_name='текст')),
+                ('image', models.ImageField(upload_to='banners', verbose_name='картинка')),
+                ('order', models.PositiveIntegerField(db_index=True, default=0, help_text='баннеры показываются по возрастанию', verbose_name='порядок')),
+                ('is_active', models.BooleanField(default=True, verbose_name='показывать')),
+                ('active_from', models.DateTimeField(blank=True, help_text='пусто — сразу', null=True, verbose_name='показывать с')),
+                ('active_until', models.DateTimeField(blank=True, help_text='пусто — всегда', null=True, verbose_name='показывать до')),
+            ],
+            options={
+                'verbose_name': 'баннер',
+                'verbose_name_plural': 'баннеры',
+                'ordering': ['order', 'id'],
+            },
+        ),
+        migrations.RunPython(add_banners, reverse_code=delete_banners),
+    ]
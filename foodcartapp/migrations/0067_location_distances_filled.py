@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0066_banner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='distances_filled',
+            field=models.BooleanField(default=False, editable=False, verbose_name='расстояния до ресторанов посчитаны'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+import re
+
+from django.db import migrations
+
+
+# A copy of services.addresses.normalize_address as of this migration, so
+# later changes to the normalizer don't change what it does. Unlike the
+# copy in 0062, «пр» is left as is: it stands for проезд just as well.
+NOISE_WORDS = {'г', 'гор', 'город', 'д', 'дом'}
+
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'наб': 'набережная',
+    'туп': 'тупик',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'кв': 'квартира',
+}
+
+SEPARATORS_RE = re.compile(r'[^\w/-]+|(?<!\w)[/-]|[/-](?!\w)|_')
+
+
+def normalize_address(address):
+    words = SEPARATORS_RE.sub(' ', address.casefold().replace('ё', 'е')).split()
+    return ' '.join(
+        ABBREVIATIONS.get(word, word) for word in words if word not in NOISE_WORDS
+    )
+
+
+def rekey_locations(apps, schema_editor):
+    """Keys made while «пр» was read as «проспект» are made again without it."""
+    Location = apps.get_model('foodcartapp', 'Location')
+    locations = []
+    for location in Location.objects.only('id', 'address', 'address_key').iterator():
+        address_key = normalize_address(location.address)
+        if address_key != location.address_key:
+            location.address_key = address_key
+            locations.append(location)
+    Location.objects.bulk_update(locations, ['address_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0067_location_distances_filled'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_locations, reverse_code=migrations.RunPython.noop),
+    ]
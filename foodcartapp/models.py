@@ -1,12 +1,17 @@
 from decimal import Decimal
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import DecimalField, F, Sum
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from phonenumber_field.modelfields import PhoneNumberField
 
+from foodcartapp.services.addresses import normalize_address
+
 
 class OrderQuerySet(models.QuerySet):
     def with_total_price(self):
@@ -18,6 +23,25 @@ class OrderQuerySet(models.QuerySet):
         )
 
 
+class OrderChangeQuerySet(models.QuerySet):
+    def record(self, order_ids, removed=False):
+        """Log the changes once the current transaction commits.
+
+        A change written inside a long transaction would take its id long
+        before readers can see it, and readers go after the changes by id.
+        """
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        transaction.on_commit(lambda: self.bulk_create([
+            OrderChange(order_id=order_id, removed=removed)
+            for order_id in order_ids
+        ]))
+
+    def prune(self, before):
+        return self.filter(changed_at__lt=before).delete()[0]
+
+
 class Restaurant(models.Model):
     name = models.CharField(
         'название',
@@ -41,6 +65,12 @@ class Restaurant(models.Model):
         verbose_name='координаты',
         related_name='restaurants'
     )
+    max_active_orders = models.PositiveIntegerField(
+        'макс. заказов на сборке',
+        null=True,
+        blank=True,
+        help_text='Пусто — без ограничений',
+    )
 
     class Meta:
         verbose_name = 'ресторан'
@@ -49,15 +79,94 @@ class Restaurant(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        restaurant = super().from_db(db, field_names, values)
+        # Distances to the restaurant are only refilled when it moves
+        restaurant.loaded_location_id = restaurant.__dict__.get('location_id')
+        return restaurant
+
 
 class ProductQuerySet(models.QuerySet):
     def available(self):
-        products = (
-            RestaurantMenuItem.objects
-            .filter(availability=True)
-            .values_list('product')
+        return self.filter(available_anywhere=True)
+
+    def recount_availability(self):
+        """Recount from the menus in how many restaurants the products are on sale.
+
+        The products are locked first, so concurrent recounts of a product
+        run one after another and the last one sees every committed change.
+        """
+        available_items = RestaurantMenuItem.objects.filter(
+            product=OuterRef('pk'),
+            availability=True,
+        )
+        available_count = (
+            available_items
+            .order_by()
+            .values('product')
+            .annotate(count=Count('pk'))
+            .values('count')
         )
-        return self.filter(pk__in=products)
+        with transaction.atomic(using=self.db):
+            product_ids = list(
+                self.select_for_update().order_by('id').values_list('id', flat=True)
+            )
+            return Product.objects.filter(id__in=product_ids).update(
+                available_restaurants_count=Coalesce(Subquery(available_count), 0),
+                available_anywhere=Exists(available_items),
+            )
+
+
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    """Keeps the products' availability up to date on bulk changes too.
+
+    bulk_update goes through update(), saves and deletes of single items
+    are handled by signals.
+    """
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            menu_items = list(self.values_list('product_id', 'restaurant_id'))
+            product_ids = {product_id for product_id, _ in menu_items}
+            restaurant_ids = {restaurant_id for _, restaurant_id in menu_items}
+            rows_count = super().update(**kwargs)
+            for field, ids in [('product', product_ids), ('restaurant', restaurant_ids)]:
+                for name in [field, f'{field}_id']:
+                    if name in kwargs:
+                        ids.add(getattr(kwargs[name], 'pk', kwargs[name]))
+            Product.objects.filter(id__in=product_ids).recount_availability()
+            transaction.on_commit(lambda: invalidate_menu_caches(restaurant_ids))
+        return rows_count
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Product.objects.filter(
+                id__in={menu_item.product_id for menu_item in objs},
+            ).recount_availability()
+            restaurant_ids = {menu_item.restaurant_id for menu_item in objs}
+            transaction.on_commit(lambda: invalidate_menu_caches(restaurant_ids))
+        return objs
+
+    bulk_create.alters_data = True
+
+
+def invalidate_menu_caches(restaurant_ids=None):
+    """Drop what is built from the menus, of all restaurants without ids."""
+    # Services import the models, so they can't be imported on top
+    from foodcartapp.services.availability import invalidate_availability_index
+    from foodcartapp.services.catalog import invalidate_catalog
+    from foodcartapp.services.menus import invalidate_all_menus, invalidate_menus
+
+    invalidate_availability_index()
+    invalidate_catalog()
+    if restaurant_ids is None:
+        invalidate_all_menus()
+    else:
+        invalidate_menus(restaurant_ids)
 
 
 class ProductCategory(models.Model):
@@ -98,6 +207,12 @@ class Product(models.Model):
     image = models.ImageField(
         'картинка'
     )
+    # Resized copies of the image, see services.images
+    image_variants = models.JSONField(
+        'уменьшенные копии картинки',
+        default=dict,
+        editable=False,
+    )
     special_status = models.BooleanField(
         'спец.предложение',
         default=False,
@@ -108,6 +223,18 @@ class Product(models.Model):
         max_length=200,
         blank=True,
     )
+    # Kept up to date from the restaurants' menus, see recount_availability
+    available_restaurants_count = models.PositiveIntegerField(
+        'в скольких ресторанах в продаже',
+        default=0,
+        editable=False,
+    )
+    available_anywhere = models.BooleanField(
+        'есть в продаже',
+        default=False,
+        db_index=True,
+        editable=False,
+    )
 
     objects = ProductQuerySet.as_manager()
 
@@ -118,6 +245,32 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # A copy loaded before a recount or before the image copies
+            # were made mustn't overwrite them
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ['available_restaurants_count', 'available_anywhere', 'image_variants']
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def has_image_variants(self):
+        """If the resized copies are made of the current image."""
+        return bool(self.image) and self.image_variants.get('source') == self.image.name
+
+    def get_image_url(self, size):
+        """URL of a JPEG copy of the image, the original until copies are made."""
+        if self.has_image_variants:
+            return self.image.storage.url(self.image_variants['sizes'][size]['jpeg'])
+        return self.image.url if self.image else ''
+
+    @property
+    def thumbnail_url(self):
+        return self.get_image_url('thumbnail')
+
 
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
@@ -138,6 +291,8 @@ class RestaurantMenuItem(models.Model):
         db_index=True
     )
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'пункт меню ресторана'
         verbose_name_plural = 'пункты меню ресторана'
@@ -147,6 +302,14 @@ class RestaurantMenuItem(models.Model):
 
     def __str__(self):
         return f"{self.restaurant.name} - {self.product.name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        menu_item = super().from_db(db, field_names, values)
+        # An item moved to another product or restaurant changes both
+        menu_item.loaded_product_id = menu_item.__dict__.get('product_id')
+        menu_item.loaded_restaurant_id = menu_item.__dict__.get('restaurant_id')
+        return menu_item
     
 
 class Order(models.Model):
@@ -229,6 +392,24 @@ class Order(models.Model):
         verbose_name='координаты',
         related_name='orders'
     )
+    manager = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='менеджер',
+        related_name='claimed_orders',
+    )
+    claimed_at = models.DateTimeField(
+        'взят в работу',
+        null=True,
+        blank=True,
+    )
+    version = models.PositiveIntegerField(
+        'версия',
+        default=0,
+        editable=False,
+    )
 
     objects = OrderQuerySet.as_manager()
     
@@ -236,10 +417,15 @@ class Order(models.Model):
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
         ordering = ['-registered_at']
+        indexes = [
+            models.Index(fields=['status', '-id'], name='order_status_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.restaurant and self.status == 'raw':
             self.status = 'in_progress'
+        if self.pk:
+            self.version += 1
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -287,8 +473,21 @@ class OrderItem(models.Model):
 
 class Location(models.Model):
     address = models.CharField('адрес', max_length=255, unique=True)
+    address_key = models.CharField(
+        'нормализованный адрес',
+        max_length=255,
+        unique=True,
+        editable=False,
+    )
     lat = models.FloatField('широта', null=True, blank=True)
     lon = models.FloatField('долгота', null=True, blank=True)
+    # Set once distances to the restaurants around are stored, even if
+    # there are none, see services.distance_cache
+    distances_filled = models.BooleanField(
+        'расстояния до ресторанов посчитаны',
+        default=False,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'координаты'
@@ -297,4 +496,153 @@ class Location(models.Model):
     def __str__(self):
         return self.address
 
+    def clean(self):
+        duplicate = (
+            Location.objects
+            .filter(address_key=normalize_address(self.address))
+            .exclude(pk=self.pk)
+            .first()
+        )
+        if duplicate:
+            raise ValidationError({
+                'address': f'Этот адрес уже есть в базе как «{duplicate.address}»',
+            })
+
+    def save(self, *args, **kwargs):
+        self.address_key = normalize_address(self.address)
+        super().save(*args, **kwargs)
+
+    @property
+    def coords(self):
+        if self.lat and self.lon:
+            return self.lat, self.lon
+        return None
 
+
+class LocationDistance(models.Model):
+    origin = models.ForeignKey(
+        Location,
+        on_delete=models.CASCADE,
+        related_name='distances_from',
+        verbose_name='откуда',
+    )
+    destination = models.ForeignKey(
+        Location,
+        on_delete=models.CASCADE,
+        related_name='distances_to',
+        verbose_name='куда',
+    )
+    km = models.FloatField('расстояние, км')
+
+    class Meta:
+        verbose_name = 'расстояние'
+        verbose_name_plural = 'расстояния'
+        unique_together = [
+            ['origin', 'destination']
+        ]
+
+    def __str__(self):
+        return f'{self.origin} — {self.destination}: {self.km:.2f} км'
+
+
+class OrderChange(models.Model):
+    order_id = models.IntegerField('заказ', db_index=True)
+    removed = models.BooleanField(
+        'убран из списка заказов',
+        default=False,
+    )
+    changed_at = models.DateTimeField(
+        'время изменения',
+        default=timezone.now,
+        db_index=True,
+    )
+
+    objects = OrderChangeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'изменение заказа'
+        verbose_name_plural = 'изменения заказов'
+
+    def __str__(self):
+        return f'Заказ #{self.order_id} изменён {self.changed_at}'
+
+
+class GeocodeTask(models.Model):
+    STATUS = [
+        ('pending', 'Ожидает'),
+        ('done', 'Выполнено'),
+        ('failed', 'Адрес не найден'),
+    ]
+    address = models.CharField('адрес', max_length=255, unique=True)
+    status = models.CharField(
+        'статус',
+        max_length=20,
+        choices=STATUS,
+        default='pending',
+    )
+    attempts = models.PositiveSmallIntegerField('попыток', default=0)
+    run_after = models.DateTimeField(
+        'не раньше',
+        default=timezone.now,
+    )
+    last_error = models.TextField('последняя ошибка', blank=True)
+    created_at = models.DateTimeField(
+        'создано',
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = 'задача геокодирования'
+        verbose_name_plural = 'задачи геокодирования'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='geocodetask_status_run_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.address} ({self.get_status_display()})'
+
+
+class Banner(models.Model):
+    title = models.CharField('заголовок', max_length=50)
+    text = models.CharField('текст', max_length=200, blank=True)
+    image = models.ImageField('картинка', upload_to='banners')
+    order = models.PositiveIntegerField(
+        'порядок',
+        default=0,
+        db_index=True,
+        help_text='баннеры показываются по возрастанию',
+    )
+    is_active = models.BooleanField('показывать', default=True)
+    active_from = models.DateTimeField(
+        'показывать с',
+        null=True,
+        blank=True,
+        help_text='пусто — сразу',
+    )
+    active_until = models.DateTimeField(
+        'показывать до',
+        null=True,
+        blank=True,
+        help_text='пусто — всегда',
+    )
+
+    class Meta:
+        verbose_name = 'баннер'
+        verbose_name_plural = 'баннеры'
+        ordering = ['order', 'id']
+
+    def __str__(self):
+        return self.title
+
+    def clean(self):
+        if self.active_from and self.active_until and self.active_until <= self.active_from:
+            raise ValidationError({
+                'active_until': 'Баннер должен исчезать позже, чем появляется',
+            })
+
+    def is_shown(self, now):
+        return (
+            self.is_active
+            and (self.active_from is None or self.active_from <= now)
+            and (self.active_until is None or now < self.active_until)
+        )
@@ -2,9 +2,8 @@ from rest_framework import serializers
 from foodcartapp.models import Order, OrderItem
 from rest_framework.serializers import ModelSerializer
 
-from foodcartapp.services.geolocation import (
-    get_or_update_coordinates,
-)
+from foodcartapp.services.distance_cache import fill_order_distances
+from foodcartapp.services.geocoding_queue import locate_address
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -22,20 +21,12 @@ class OrderSerializer(ModelSerializer):
 
     def create(self, validated_data):
         products_data = validated_data.pop("products")
-        order = Order.objects.create(**validated_data)
-
-        coords_cache = {} 
-        updated_orders = []
-
-        get_or_update_coordinates(
-            obj=order,
-            address=order.address,
-            coords_cache=coords_cache,
-            updated_objects=updated_orders,
-        )
-
-        if updated_orders:
-            Order.objects.bulk_update(updated_orders, ["location"])
+        # Unknown addresses are geocoded by the geocode_worker command,
+        # so a slow geocoder doesn't hold up the checkout
+        location = locate_address(validated_data["address"])
+        order = Order.objects.create(**validated_data, location=location)
+        if location and not location.distances_filled:
+            fill_order_distances([location])
 
         order_items = [
             OrderItem(
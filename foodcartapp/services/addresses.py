@@ -0,0 +1,43 @@
+import re
+
+
+# Words that say nothing about the place, «г. Москва, д. 15» is just «Москва, 15»
+NOISE_WORDS = {'г', 'гор', 'город', 'д', 'дом'}
+
+ABBREVIATIONS = {
+    'ул': 'улица',
+    # Not пр, it stands for проезд just as well
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'наб': 'набережная',
+    'туп': 'тупик',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'кв': 'квартира',
+}
+
+# Anything but letters, digits and the hyphens and slashes inside words
+# and house numbers like пр-т or 15/2
+SEPARATORS_RE = re.compile(r'[^\w/-]+|(?<!\w)[/-]|[/-](?!\w)|_')
+
+
+def normalize_address(address):
+    """Canonical form of an address to tell if two strings mean the same place.
+
+    Case, ё, quotes, punctuation, extra whitespace and common abbreviations
+    like ул. or пр-т don't matter: «г. Москва, ул. Новый Арбат, д. 15» and
+    «москва улица новый арбат 15» get the same key.
+    """
+    words = SEPARATORS_RE.sub(' ', address.casefold().replace('ё', 'е')).split()
+    return ' '.join(
+        ABBREVIATIONS.get(word, word) for word in words if word not in NOISE_WORDS
+    )
@@ -0,0 +1,193 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Q
+
+from foodcartapp.models import Order, OrderChange, Restaurant
+from foodcartapp.services.availability import get_availability_index
+from foodcartapp.services.claims import claimable_by
+from foodcartapp.services.distance_cache import get_order_distances
+
+
+def solve_capacitated_assignment(costs, capacities):
+    """Assign rows to columns minimizing the total cost within capacities.
+
+    costs is an orders × restaurants array with inf where an order can't
+    go, capacities holds how many more orders each restaurant can take.
+
+    Orders are added one by one in row order (successive shortest paths),
+    so when capacities run out later rows never push out earlier ones. While the
+    nearest restaurant has room that is the whole job; otherwise Dijkstra
+    over restaurants finds the cheapest chain of reassignments ending in a
+    restaurant with room. Edges are kept non-negative with dual prices of
+    full restaurants, as in the Hungarian method, so every step keeps the
+    assignment optimal. Returns the column of every row, -1 for rows left
+    unassigned.
+    """
+    costs = np.asarray(costs, dtype=float)
+    orders_count, restaurants_count = costs.shape
+    capacities = np.asarray(capacities)
+    assignment = np.full(orders_count, -1)
+    loads = np.zeros(restaurants_count, dtype=int)
+    members_of = [set() for _ in range(restaurants_count)]
+    prices = np.zeros(restaurants_count)
+
+    # Cheapest change of total cost when moving one order from r1 to r2,
+    # and that order. A row is recomputed lazily once the orders of its
+    # restaurant have changed.
+    move_costs = np.full((restaurants_count, restaurants_count), np.inf)
+    movers = np.full((restaurants_count, restaurants_count), -1)
+    stale_restaurants = set()
+
+    def get_moves(restaurant):
+        if restaurant in stale_restaurants:
+            stale_restaurants.discard(restaurant)
+            members = np.fromiter(members_of[restaurant], dtype=int)
+            if not len(members):
+                move_costs[restaurant] = np.inf
+                return move_costs[restaurant]
+            deltas = costs[members] - costs[members, restaurant][:, np.newaxis]
+            best_members = deltas.argmin(axis=0)
+            move_costs[restaurant] = deltas[best_members, np.arange(restaurants_count)]
+            move_costs[restaurant, restaurant] = np.inf
+            movers[restaurant] = members[best_members]
+        return move_costs[restaurant]
+
+    def assign(row, restaurant):
+        previous = assignment[row]
+        if previous != -1:
+            members_of[previous].remove(row)
+            stale_restaurants.add(previous)
+        assignment[row] = restaurant
+        members_of[restaurant].add(row)
+        stale_restaurants.add(restaurant)
+
+    for row in range(orders_count):
+        row_costs = costs[row]
+        nearest = row_costs.argmin()
+        if not np.isfinite(row_costs[nearest]):
+            continue
+        if loads[nearest] < capacities[nearest]:
+            assign(row, nearest)
+            loads[nearest] += 1
+            continue
+
+        path_costs = row_costs + prices
+        predecessors = np.full(restaurants_count, -1)
+        settled = np.zeros(restaurants_count, dtype=bool)
+        target = None
+        while True:
+            restaurant = np.where(settled, np.inf, path_costs).argmin()
+            if settled[restaurant] or not np.isfinite(path_costs[restaurant]):
+                break
+            settled[restaurant] = True
+            if loads[restaurant] < capacities[restaurant]:
+                target = restaurant
+                break
+            reduced_costs = (
+                path_costs[restaurant] + get_moves(restaurant)
+                + prices - prices[restaurant]
+            )
+            improved = (reduced_costs < path_costs) & ~settled
+            path_costs[improved] = reduced_costs[improved]
+            predecessors[improved] = restaurant
+        if target is None:
+            continue
+
+        prices[settled] += np.maximum(path_costs[target] - path_costs[settled], 0)
+        restaurant = target
+        while predecessors[restaurant] != -1:
+            source = predecessors[restaurant]
+            assign(movers[source, restaurant], restaurant)
+            restaurant = source
+        assign(row, restaurant)
+        loads[target] += 1
+
+    return assignment
+
+
+def get_restaurant_capacities(restaurants, orders_count):
+    """How many more orders every restaurant can take, ignoring limits if unset."""
+    restaurants_load = dict(
+        Restaurant.objects
+        .annotate(load=Count('orders', filter=Q(orders__status='in_progress')))
+        .values_list('id', 'load')
+    )
+    return [
+        orders_count if restaurant.max_active_orders is None
+        else max(restaurant.max_active_orders - restaurants_load.get(restaurant.id, 0), 0)
+        for restaurant in restaurants
+    ]
+
+
+def propose_assignment(orders=None):
+    """Best restaurant for every raw unassigned order.
+
+    Returns (order, restaurant, km) triples. When restaurants run out of
+    capacity older orders go first, the rest are left out.
+    """
+    if orders is None:
+        orders = Order.objects.all()
+    orders = list(
+        orders.filter(status='raw', restaurant__isnull=True, location__isnull=False)
+        .select_related('location')
+        .prefetch_related('items')
+        .order_by('id')
+    )
+    restaurants = list(Restaurant.objects.select_related('location').order_by('id'))
+    if not orders or not restaurants:
+        return []
+
+    columns = {restaurant.id: column for column, restaurant in enumerate(restaurants)}
+    availability_index = get_availability_index()
+    distances = get_order_distances(orders, restaurants)
+
+    costs = np.full((len(orders), len(restaurants)), np.inf)
+    for row, order in enumerate(orders):
+        eligible_ids = availability_index.get_eligible_restaurant_ids(
+            [item.product_id for item in order.items.all()]
+        )
+        for restaurant_id in eligible_ids:
+            column = columns.get(restaurant_id)
+            if column is None:
+                continue
+            dist = distances.get((order.location_id, restaurants[column].location_id))
+            if dist is not None:
+                costs[row, column] = dist
+
+    assignment = solve_capacitated_assignment(
+        costs,
+        get_restaurant_capacities(restaurants, len(orders)),
+    )
+    return [
+        (order, restaurants[column], float(costs[row, column]))
+        for row, (order, column) in enumerate(zip(orders, assignment))
+        if column != -1
+    ]
+
+
+@transaction.atomic
+def apply_assignment(proposals, user=None):
+    """Save proposed restaurants of the orders still raw and unassigned.
+
+    Orders other managers are working on are left to them.
+    """
+    restaurant_ids = {order.id: restaurant.id for order, restaurant, _ in proposals}
+    orders = list(
+        Order.objects.select_for_update(skip_locked=True)
+        .filter(
+            claimable_by(user),
+            id__in=restaurant_ids,
+            status='raw',
+            restaurant__isnull=True,
+        )
+    )
+    for order in orders:
+        order.restaurant_id = restaurant_ids[order.id]
+        # bulk_update skips Order.save, which does the same
+        order.status = 'in_progress'
+        order.version += 1
+    Order.objects.bulk_update(
+        orders, ['restaurant', 'status', 'version'], batch_size=1000,
+    )
+    OrderChange.objects.record([order.id for order in orders])
+    return orders
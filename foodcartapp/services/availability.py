@@ -0,0 +1,103 @@
+import threading
+
+from foodcartapp.models import Restaurant, RestaurantMenuItem
+from foodcartapp.services.cache_versions import bump_version, get_version
+
+
+INDEX_VERSION_CACHE_KEY = 'foodcartapp:availability_index_version'
+
+
+class AvailabilityIndex:
+    """Which restaurants can cook which products, as one bitmask per product.
+
+    Every restaurant gets a bit position; a product's mask has the bits of
+    the restaurants where it is on sale. Restaurants able to cook a whole
+    order are the AND of its products' masks.
+    """
+
+    def __init__(self):
+        self.restaurant_bits = {}
+        self.restaurant_ids = []
+        self.product_masks = {}
+        self.all_restaurants_mask = 0
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for restaurant_id in Restaurant.objects.order_by('id').values_list('id', flat=True):
+            index.add_restaurant(restaurant_id)
+
+        menu_items = (
+            RestaurantMenuItem.objects
+            .filter(availability=True)
+            .values_list('product_id', 'restaurant_id')
+        )
+        for product_id, restaurant_id in menu_items:
+            index.set_availability(product_id, restaurant_id, True)
+        return index
+
+    def add_restaurant(self, restaurant_id):
+        bit = self.restaurant_bits.get(restaurant_id)
+        if bit is None:
+            bit = len(self.restaurant_ids)
+            self.restaurant_bits[restaurant_id] = bit
+            self.restaurant_ids.append(restaurant_id)
+            self.all_restaurants_mask |= 1 << bit
+        return bit
+
+    def set_availability(self, product_id, restaurant_id, available):
+        bit = self.add_restaurant(restaurant_id)
+        mask = self.product_masks.get(product_id, 0)
+        if available:
+            mask |= 1 << bit
+        else:
+            mask &= ~(1 << bit)
+        self.product_masks[product_id] = mask
+
+    def get_mask(self, product_ids):
+        mask = self.all_restaurants_mask
+        for product_id in product_ids:
+            mask &= self.product_masks.get(product_id, 0)
+            if not mask:
+                break
+        return mask
+
+    def iter_restaurant_ids(self, mask):
+        while mask:
+            lowest_bit = mask & -mask
+            yield self.restaurant_ids[lowest_bit.bit_length() - 1]
+            mask ^= lowest_bit
+
+    def get_eligible_restaurant_ids(self, product_ids):
+        return list(self.iter_restaurant_ids(self.get_mask(product_ids)))
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_availability_index():
+    """Per-process index, rebuilt when another process reports a change."""
+    global _index, _index_version
+
+    version = get_version(INDEX_VERSION_CACHE_KEY)
+    with _index_lock:
+        if _index is None or version != _index_version:
+            _index = AvailabilityIndex.build()
+            _index_version = version
+        return _index
+
+
+def invalidate_availability_index():
+    """Rebuild the index everywhere after a change of the menus or restaurants.
+
+    The process making the change rebuilds it too instead of patching its
+    copy: a change another process makes at the same moment may be missed
+    by the patched copy, and the version alone can't tell.
+    """
+    global _index
+
+    bump_version(INDEX_VERSION_CACHE_KEY)
+    with _index_lock:
+        _index = None
@@ -0,0 +1,88 @@
+import math
+import threading
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from foodcartapp.models import Banner
+from foodcartapp.renderers import dumps
+from foodcartapp.services.cache_versions import bump_version, get_version
+from foodcartapp.services.compression import CompressedPayload
+
+
+BANNERS_VERSION_CACHE_KEY = 'foodcartapp:banners_version'
+BANNERS_CACHE_KEY_PREFIX = 'foodcartapp:banners:'
+
+
+def serialize_banner(banner):
+    return {
+        "title": banner.title,
+        "src": banner.image.url,
+        "text": banner.text,
+    }
+
+
+def build_banners(now):
+    """Payload of the banners shown now and the moment it changes by itself.
+
+    The moment is the nearest start or end of a banner's window, None if
+    no window starts or ends in the future.
+    """
+    banners = list(Banner.objects.filter(is_active=True).exclude(active_until__lte=now))
+    window_bounds = [
+        moment
+        for banner in banners
+        for moment in [banner.active_from, banner.active_until]
+        if moment and moment > now
+    ]
+    payload = CompressedPayload(dumps([
+        serialize_banner(banner) for banner in banners if banner.is_shown(now)
+    ]))
+    return payload, min(window_bounds, default=None)
+
+
+def is_expired(expires_at, now):
+    return expires_at is not None and expires_at <= now
+
+
+_banners = None
+_banners_version = None
+_banners_lock = threading.Lock()
+
+
+def get_banners():
+    """Banners shown now, built once for all processes.
+
+    Like the catalog, the payload is kept under a version bumped on every
+    change of the banners. It's also rebuilt when a banner's window starts
+    or ends, so requests never check the windows themselves.
+    """
+    global _banners, _banners_version
+
+    now = timezone.now()
+    version = get_version(BANNERS_VERSION_CACHE_KEY)
+    with _banners_lock:
+        if _banners is not None and version == _banners_version and not is_expired(_banners[1], now):
+            return _banners[0]
+
+    cache_key = f'{BANNERS_CACHE_KEY_PREFIX}{version}'
+    banners = cache.get(cache_key)
+    if banners is None or is_expired(banners[1], now):
+        banners = build_banners(now)
+        expires_at = banners[1]
+        timeout = None if expires_at is None else max(math.ceil((expires_at - now).total_seconds()), 1)
+        cache.set(cache_key, banners, timeout=timeout)
+    with _banners_lock:
+        _banners = banners
+        _banners_version = version
+    return banners[0]
+
+
+def invalidate_banners():
+    global _banners
+
+    previous_version = bump_version(BANNERS_VERSION_CACHE_KEY)
+    with _banners_lock:
+        _banners = None
+    if previous_version:
+        cache.delete(f'{BANNERS_CACHE_KEY_PREFIX}{previous_version}')
@@ -0,0 +1,37 @@
+import random
+import time
+
+from django.core.cache import cache
+
+
+# Microseconds
+VERSION_SPREAD = 10 ** 6
+
+
+def get_new_version():
+    """A new value for a version key.
+
+    A key may have been evicted while payloads of its versions are still
+    cached, so versions never start over: microseconds since the epoch are
+    ahead of the versions before. The random offset of up to a second tells
+    apart changes made at the same moment. Versions are shown in the API,
+    so they stay within the integers JavaScript reads exactly.
+    """
+    return time.time_ns() // 1000 + random.randrange(VERSION_SPREAD)
+
+
+def get_version(key):
+    cache.add(key, get_new_version(), timeout=None)
+    return cache.get(key)
+
+
+def bump_version(key):
+    """Move the version to a new value, returns the previous one.
+
+    Not cache.incr: the database cache does it as a get and a set, so two
+    processes bumping at once would both land on the same version and one
+    change would never reach the readers. Random new values do.
+    """
+    previous_version = cache.get(key)
+    cache.set(key, get_new_version(), timeout=None)
+    return previous_version
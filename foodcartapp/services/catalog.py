@@ -0,0 +1,142 @@
+import threading
+
+from django.core.cache import cache
+
+from foodcartapp.models import Product
+from foodcartapp.renderers import dumps
+from foodcartapp.services.cache_versions import bump_version, get_version
+from foodcartapp.services.compression import CompressedPayload
+from foodcartapp.services.images import get_srcset
+
+
+CATALOG_VERSION_CACHE_KEY = 'foodcartapp:catalog_version'
+CATALOG_CACHE_KEY_PREFIX = 'foodcartapp:catalog:'
+PRODUCTS_PAGE_SIZE = 100
+PRODUCTS_MAX_PAGE_SIZE = 1000
+
+# Columns every field of the product API is read from
+PRODUCT_FIELD_COLUMNS = {
+    "id": ["id"],
+    "name": ["name"],
+    "price": ["price"],
+    "special_status": ["special_status"],
+    "description": ["description"],
+    "category": ["category_id", "category__name"],
+    "image": ["image"],
+    "srcset": ["image", "image_variants"],
+}
+
+
+def serialize_product(product):
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "special_status": product.special_status,
+        "description": product.description,
+        "category": {
+            "id": product.category.id,
+            "name": product.category.name,
+        }
+        if product.category
+        else None,
+        "image": product.image.url,
+        "srcset": get_srcset(product.image_variants) if product.has_image_variants else {},
+    }
+
+
+def build_catalog():
+    products = Product.objects.select_related("category").available()
+    return CompressedPayload(dumps([
+        {
+            **serialize_product(product),
+            # Not a real restaurant, the storefront just expects the field,
+            # real menus are in the menus API
+            "restaurant": {
+                "id": product.id,
+                "name": product.name,
+            },
+        }
+        for product in products
+    ]))
+
+
+def serialize_product_values(values, fields):
+    product = {}
+    for field in fields:
+        if field == "category":
+            product["category"] = {
+                "id": values["category_id"],
+                "name": values["category__name"],
+            } if values["category_id"] else None
+        elif field == "image":
+            product["image"] = Product._meta.get_field("image").storage.url(values["image"])
+        elif field == "srcset":
+            image_variants = values["image_variants"]
+            product["srcset"] = (
+                get_srcset(image_variants)
+                if values["image"] and image_variants.get("source") == values["image"]
+                else {}
+            )
+        else:
+            product[field] = values[field]
+    return product
+
+
+def get_products_page(fields, after=None, limit=PRODUCTS_PAGE_SIZE):
+    """A page of available products by id with just the given fields.
+
+    Only the columns of these fields are read, the category is joined
+    only when asked for. The cursor of the next page is the id of the
+    last product, None on the last page.
+    """
+    columns = ["id"]
+    for field in fields:
+        columns.extend(PRODUCT_FIELD_COLUMNS[field])
+    products = Product.objects.available().order_by("id")
+    if after is not None:
+        products = products.filter(id__gt=after)
+    rows = list(products.values(*dict.fromkeys(columns))[:limit + 1])
+
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return [serialize_product_values(row, fields) for row in rows[:limit]], next_cursor
+
+
+_catalog = None
+_catalog_version = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """The catalog of the current version, built once for all processes.
+
+    The version lives in the shared cache and is bumped on every change,
+    so a catalog built from data read before a change is stored under an
+    outdated key and never served.
+    """
+    global _catalog, _catalog_version
+
+    version = get_version(CATALOG_VERSION_CACHE_KEY)
+    with _catalog_lock:
+        if _catalog is not None and version == _catalog_version:
+            return _catalog
+
+    cache_key = f'{CATALOG_CACHE_KEY_PREFIX}{version}'
+    catalog = cache.get(cache_key)
+    if catalog is None:
+        catalog = build_catalog()
+        cache.set(cache_key, catalog, timeout=None)
+    with _catalog_lock:
+        _catalog = catalog
+        _catalog_version = version
+    return catalog
+
+
+def invalidate_catalog():
+    global _catalog
+
+    previous_version = bump_version(CATALOG_VERSION_CACHE_KEY)
+    with _catalog_lock:
+        _catalog = None
+    if previous_version:
+        cache.delete(f'{CATALOG_CACHE_KEY_PREFIX}{previous_version}')
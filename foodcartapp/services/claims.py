@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from foodcartapp.models import Order, OrderChange
+
+
+class OrderConflict(Exception):
+    """The order was changed by someone else since the manager loaded it."""
+
+
+def get_claim_expiry():
+    return timezone.now() - timedelta(minutes=settings.ORDER_CLAIM_TIMEOUT_MINUTES)
+
+
+def claimable_by(user):
+    """Orders nobody else is working on right now."""
+    return (
+        Q(manager__isnull=True)
+        | Q(manager=user)
+        | Q(claimed_at__lt=get_claim_expiry())
+    )
+
+
+@transaction.atomic
+def claim_orders(user, limit):
+    """Take up to limit oldest raw unassigned orders into work.
+
+    Rows locked by another manager's claim are skipped rather than waited
+    for, so concurrent claims get different orders without blocking.
+    """
+    order_ids = list(
+        Order.objects
+        .select_for_update(skip_locked=True, of=('self',))
+        .filter(claimable_by(user), status='raw', restaurant__isnull=True)
+        .order_by('id')
+        .values_list('id', flat=True)[:limit]
+    )
+    Order.objects.filter(id__in=order_ids).update(
+        manager=user,
+        claimed_at=timezone.now(),
+        version=F('version') + 1,
+    )
+    OrderChange.objects.record(order_ids)
+    return order_ids
+
+
+@transaction.atomic
+def release_orders(user, order_ids):
+    released_ids = list(
+        Order.objects
+        .select_for_update()
+        .filter(id__in=order_ids, manager=user, status='raw', restaurant__isnull=True)
+        .values_list('id', flat=True)
+    )
+    Order.objects.filter(id__in=released_ids).update(
+        manager=None,
+        claimed_at=None,
+        version=F('version') + 1,
+    )
+    OrderChange.objects.record(released_ids)
+    return released_ids
+
+
+@transaction.atomic
+def assign_restaurant(order_id, restaurant_id, version, user):
+    """Assign the restaurant if the order is still at the version the manager saw.
+
+    Returns the new version, raises OrderConflict when the order was changed
+    or claimed by someone else meanwhile.
+    """
+    updated = (
+        Order.objects
+        .filter(claimable_by(user), id=order_id, version=version)
+        .exclude(status='completed')
+        .update(
+            restaurant_id=restaurant_id,
+            # Order.save does the same
+            status=Case(
+                When(status='raw', then=Value('in_progress')),
+                default=F('status'),
+            ),
+            manager=user,
+            claimed_at=timezone.now(),
+            version=F('version') + 1,
+        )
+    )
+    if not updated:
+        raise OrderConflict(order_id)
+    OrderChange.objects.record([order_id])
+    return version + 1
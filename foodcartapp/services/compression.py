@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+# Preferred first when a client accepts several equally
+ENCODINGS = ['br', 'gzip']
+
+
+def compress(content, encoding):
+    if encoding == 'gzip':
+        # No timestamp, so the same content always gives the same bytes
+        return gzip.compress(content, GZIP_LEVEL, mtime=0)
+    return brotli.compress(content, quality=BROTLI_QUALITY)
+
+
+def parse_accept_encoding(header):
+    """Encodings with their q-values, e.g. {'gzip': 1.0, 'br': 0.5}."""
+    qualities = {}
+    for item in header.split(','):
+        encoding, *params = [part.strip() for part in item.split(';')]
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[encoding.lower()] = quality
+    return qualities
+
+
+class CompressedPayload:
+    """Response body compressed once with every available encoding.
+
+    An encoding is kept only if it makes the body smaller. Every variant
+    has its own strong ETag, as the spec wants for different bytes.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.etag_hash = hashlib.sha256(content).hexdigest()[:32]
+        self.variants = {}
+        for encoding in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            compressed_content = compress(content, encoding)
+            if len(compressed_content) < len(content):
+                self.variants[encoding] = compressed_content
+
+    def get_etag(self, encoding=None):
+        if encoding is None:
+            return f'"{self.etag_hash}"'
+        return f'"{self.etag_hash}-{encoding}"'
+
+    def get_variant(self, accept_encoding):
+        """Encoding, body and ETag of the best variant for the client."""
+        qualities = parse_accept_encoding(accept_encoding)
+        best_encoding = None
+        best_quality = 0
+        for encoding in self.variants:
+            quality = qualities.get(encoding, qualities.get('*', 0))
+            if quality > best_quality:
+                best_encoding = encoding
+                best_quality = quality
+        if best_encoding is None:
+            return None, self.content, self.get_etag()
+        return best_encoding, self.variants[best_encoding], self.get_etag(best_encoding)
@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db.models import Q
+
+from foodcartapp.models import Location, LocationDistance, Order
+from foodcartapp.services.spatial import get_spatial_index
+
+
+# Locations the geocode worker fills at a time
+FILL_BATCH_SIZE = 500
+
+
+def get_cached_distances(origin_ids, destination_ids):
+    """Persisted km between locations as {(origin_id, destination_id): km}."""
+    if not origin_ids or not destination_ids:
+        return {}
+    distances = LocationDistance.objects.filter(
+        origin_id__in=origin_ids,
+        destination_id__in=destination_ids,
+    ).values_list('origin_id', 'destination_id', 'km')
+    return {
+        (origin_id, destination_id): km
+        for origin_id, destination_id, km in distances
+    }
+
+
+def get_nearby_distances(locations):
+    """Km from order locations to the restaurants within DELIVERY_RADIUS_KM.
+
+    Returns {(origin_id, destination_id): km}, the others are never
+    offered anyway.
+    """
+    spatial_index = get_spatial_index()
+    nearby_restaurants = spatial_index.nearest_many(
+        [(location.coords, None) for location in locations],
+        max_km=settings.DELIVERY_RADIUS_KM,
+    )
+    distances = {}
+    for location, nearby in zip(locations, nearby_restaurants):
+        for restaurant_id, km in nearby:
+            destination_id = spatial_index.location_ids[restaurant_id]
+            distances[location.id, destination_id] = km
+    return distances
+
+
+def fill_order_distances(locations):
+    """Store distances from order locations to restaurants around them.
+
+    The locations are marked as filled even if no restaurant is near, so
+    they aren't looked up again.
+    """
+    locations = [location for location in locations if location.coords]
+    if not locations:
+        return
+    LocationDistance.objects.bulk_create(
+        [
+            LocationDistance(origin_id=origin_id, destination_id=destination_id, km=km)
+            for (origin_id, destination_id), km in get_nearby_distances(locations).items()
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    Location.objects.filter(
+        id__in=[location.id for location in locations],
+    ).update(distances_filled=True)
+    for location in locations:
+        location.distances_filled = True
+
+
+def fill_pending_distances(limit=FILL_BATCH_SIZE):
+    """Fill the distances of open orders' locations that lack them.
+
+    Returns how many locations were filled, the geocode worker calls it
+    until none are left.
+    """
+    locations = list(
+        Location.objects
+        .filter(
+            distances_filled=False,
+            orders__in=Order.objects.exclude(status='completed'),
+        )
+        .exclude(lat=None)
+        .exclude(lon=None)
+        .distinct()[:limit]
+    )
+    fill_order_distances(locations)
+    return len(locations)
+
+
+def forget_filled_distances():
+    """Fill the distances of all locations again, after a restaurant opens or moves.
+
+    The stored ones miss the restaurant. The worker refills the locations
+    of open orders, the others are filled when an order comes to them.
+    """
+    Location.objects.filter(distances_filled=True).update(distances_filled=False)
+
+
+def invalidate_location_distances(location):
+    LocationDistance.objects.filter(
+        Q(origin=location) | Q(destination=location)
+    ).delete()
+    Location.objects.filter(id=location.id).update(distances_filled=False)
+    location.distances_filled = False
+    if location.restaurants.exists():
+        forget_filled_distances()
+
+
+def get_order_distances(orders, restaurants):
+    """Distances between order and restaurant locations.
+
+    Read only: the distances of locations not filled yet are computed on
+    the way but stored by the geocode worker.
+    """
+    order_locations = {
+        order.location_id: order.location
+        for order in orders
+        if order.location and order.location.coords
+    }
+    restaurant_location_ids = {
+        restaurant.location_id
+        for restaurant in restaurants
+        if restaurant.location and restaurant.location.coords
+    }
+    distances = get_cached_distances(order_locations, restaurant_location_ids)
+
+    unfilled_locations = [
+        location for location in order_locations.values()
+        if not location.distances_filled
+    ]
+    if unfilled_locations and restaurant_location_ids:
+        distances.update({
+            location_ids: km
+            for location_ids, km in get_nearby_distances(unfilled_locations).items()
+            if location_ids[1] in restaurant_location_ids
+        })
+    return distances
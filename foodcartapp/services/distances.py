@@ -0,0 +1,108 @@
+import numpy as np
+from geopy.distance import distance
+
+
+# WGS-84, the same ellipsoid geopy.distance.distance uses by default
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+VINCENTY_MAX_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+
+
+def to_coords_array(points):
+    """Turn a list of (lat, lon) pairs or None into a float array.
+
+    Missing points become rows of NaN, so they stay aligned with the
+    objects they came from and produce NaN distances.
+    """
+    coords = np.full((len(points), 2), np.nan, dtype=float)
+    for index, point in enumerate(points):
+        if point:
+            coords[index] = point
+    return coords
+
+
+def distance_matrix(origins, destinations):
+    """Geodesic distances in km between every origin and every destination."""
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    return geodesic_km(origins[:, np.newaxis, :], destinations[np.newaxis, :, :])
+
+
+def paired_distances(origins, destinations):
+    """Geodesic distances in km between origins[i] and destinations[i]."""
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    return geodesic_km(origins, destinations)
+
+
+def geodesic_km(origins, destinations):
+    """Batched Vincenty inverse formula on the WGS-84 ellipsoid.
+
+    Takes broadcastable arrays of (lat, lon) pairs, so the result matches
+    geopy.distance.distance to well under a metre. Pairs that do not
+    converge (nearly antipodal points) fall back to geopy.
+    """
+    origins, destinations = np.broadcast_arrays(origins, destinations)
+    lat1 = np.radians(origins[..., 0])
+    lon1 = np.radians(origins[..., 1])
+    lat2 = np.radians(destinations[..., 0])
+    lon2 = np.radians(destinations[..., 1])
+
+    u1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    delta_lon = lon2 - lon1
+    lambda_ = delta_lon.copy()
+    pending = np.isfinite(lambda_)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.hypot(
+                cos_u2 * sin_lambda,
+                cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda,
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(
+                sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lambda / sin_sigma
+            )
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(
+                cos_sq_alpha == 0,
+                0,
+                cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha,
+            )
+            c = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+            lambda_next = delta_lon + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (
+                    cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                )
+            )
+            pending = pending & (np.abs(lambda_next - lambda_) > VINCENTY_TOLERANCE)
+            lambda_ = np.where(np.isfinite(lambda_next), lambda_next, lambda_)
+            if not pending.any():
+                break
+
+        u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (
+            cos_2sigma_m + big_b / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - big_b / 6 * cos_2sigma_m
+                * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+        distances = WGS84_B * big_a * (sigma - delta_sigma)
+
+    for position in zip(*np.nonzero(pending)):
+        distances[position] = distance(
+            tuple(origins[position]), tuple(destinations[position])
+        ).km
+    return distances
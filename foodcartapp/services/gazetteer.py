@@ -0,0 +1,137 @@
+import csv
+import re
+import sqlite3
+from collections import Counter, defaultdict
+
+from foodcartapp.services.addresses import normalize_address
+
+
+CANDIDATES_LIMIT = 20
+MIN_SIMILARITY = 0.6
+# Edits allowed in a word of up to 6 letters and in a longer one: enough
+# for a typo, too few to turn Старый Арбат into Новый Арбат
+MAX_SHORT_WORD_TYPOS = 1
+MAX_LONG_WORD_TYPOS = 2
+NUMBER_RE = re.compile(r'\S*\d\S*')
+
+
+def get_trigrams(text):
+    padded = f'  {text} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def get_numbers(address_key):
+    """House, building and flat numbers, a fuzzy match must not change them."""
+    return frozenset(NUMBER_RE.findall(address_key))
+
+
+def get_edit_distance(word, other_word):
+    previous_row = list(range(len(other_word) + 1))
+    for index, letter in enumerate(word, 1):
+        row = [index]
+        for other_index, other_letter in enumerate(other_word, 1):
+            row.append(min(
+                previous_row[other_index] + 1,
+                row[other_index - 1] + 1,
+                previous_row[other_index - 1] + (letter != other_letter),
+            ))
+        previous_row = row
+    return previous_row[-1]
+
+
+def is_typo(address_key, other_key):
+    """If the addresses differ only by a few typos in the same words.
+
+    Similar trigrams alone would take Садовая 5 for Садовая-Кудринская 5,
+    so every word must match a word in the same place.
+    """
+    words = NUMBER_RE.sub(' ', address_key).split()
+    other_words = NUMBER_RE.sub(' ', other_key).split()
+    if len(words) != len(other_words):
+        return False
+    for word, other_word in zip(words, other_words):
+        max_typos = MAX_SHORT_WORD_TYPOS if len(word) <= 6 else MAX_LONG_WORD_TYPOS
+        if get_edit_distance(word, other_word) > max_typos:
+            return False
+    return True
+
+
+class GazetteerGeocoder:
+    """Offline geocoder over a list of known addresses.
+
+    Exact matches of the normalized address are a dict lookup. Anything
+    else is matched by trigram similarity among the addresses with the
+    same house numbers and taken only if every word differs by a typo or
+    two, so a typo in a street name still finds the house but a wrong
+    house number or a similar street doesn't. The trigram index of such a group
+    of addresses is built on its first fuzzy query, which keeps loading a
+    big gazetteer fast.
+    """
+
+    def __init__(self, entries):
+        self.coords_by_key = {}
+        for address, lat, lon in entries:
+            self.coords_by_key[normalize_address(address)] = (float(lat), float(lon))
+
+        self.keys = list(self.coords_by_key)
+        self.entry_ids_by_numbers = defaultdict(list)
+        for entry_id, key in enumerate(self.keys):
+            self.entry_ids_by_numbers[get_numbers(key)].append(entry_id)
+        self.trigram_indexes = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a CSV or SQLite file with address, lat and lon columns."""
+        if str(path).endswith(('.sqlite', '.sqlite3', '.db')):
+            connection = sqlite3.connect(path)
+            try:
+                return cls(connection.execute('SELECT address, lat, lon FROM gazetteer').fetchall())
+            finally:
+                connection.close()
+        with open(path, encoding='utf-8', newline='') as file:
+            return cls(
+                (row['address'], row['lat'], row['lon'])
+                for row in csv.DictReader(file)
+            )
+
+    def geocode(self, address):
+        address_key = normalize_address(address)
+        coords = self.coords_by_key.get(address_key)
+        if coords:
+            return coords
+        entry_id = self.find_similar(address_key)
+        if entry_id is None:
+            return None
+        return self.coords_by_key[self.keys[entry_id]]
+
+    def get_trigram_index(self, numbers):
+        """Trigram postings and trigram counts of the addresses with these numbers."""
+        trigram_index = self.trigram_indexes.get(numbers)
+        if trigram_index is None:
+            postings = defaultdict(list)
+            trigram_counts = {}
+            for entry_id in self.entry_ids_by_numbers.get(numbers, ()):
+                trigrams = get_trigrams(self.keys[entry_id])
+                trigram_counts[entry_id] = len(trigrams)
+                for trigram in trigrams:
+                    postings[trigram].append(entry_id)
+            trigram_index = (dict(postings), trigram_counts)
+            # Threads building the same index at once just do the work twice
+            self.trigram_indexes[numbers] = trigram_index
+        return trigram_index
+
+    def find_similar(self, address_key):
+        trigrams = get_trigrams(address_key)
+        postings, trigram_counts = self.get_trigram_index(get_numbers(address_key))
+        shared_trigrams = Counter()
+        for trigram in trigrams:
+            shared_trigrams.update(postings.get(trigram, ()))
+
+        best_entry_id = None
+        best_similarity = MIN_SIMILARITY
+        for entry_id, shared_count in shared_trigrams.most_common(CANDIDATES_LIMIT):
+            similarity = shared_count / (len(trigrams) + trigram_counts[entry_id] - shared_count)
+            if similarity >= best_similarity and is_typo(address_key, self.keys[entry_id]):
+                best_entry_id = entry_id
+                best_similarity = similarity
+        return best_entry_id
@@ -0,0 +1,189 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from geopy.exc import (
+    GeocoderQuotaExceeded,
+    GeocoderServiceError,
+    GeocoderTimedOut,
+    GeocoderUnavailable,
+)
+
+from foodcartapp.models import Location, Order, OrderChange, Restaurant
+from foodcartapp.services.addresses import normalize_address
+from foodcartapp.services.distance_cache import fill_order_distances, forget_filled_distances
+from foodcartapp.services.geocode_cache import (
+    CachedMiss, get_cache_key, remember_location, remember_miss,
+)
+from foodcartapp.services.geolocation import geocode_address
+from foodcartapp.services.spatial import invalidate_spatial_index
+
+
+UPDATE_BATCH_SIZE = 1000
+# Addresses failed even after the retries are left for the next run
+GEOCODE_RETRIES = 2
+# Seconds, doubled after every retry
+GEOCODE_RETRY_DELAY = 1
+TRANSIENT_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderQuotaExceeded)
+
+
+class RateLimiter:
+    """Spaces out calls from many threads to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            call_at = max(self.next_call_at, now)
+            self.next_call_at = call_at + self.interval
+        time.sleep(call_at - now)
+
+
+class UnlocatedAddress:
+    def __init__(self, address):
+        self.address = address
+        self.order_ids = []
+        self.restaurant_ids = []
+
+
+def get_unlocated_addresses():
+    """Addresses of orders and restaurants without coordinates, by address key."""
+    without_coords = (
+        Q(location__isnull=True)
+        | Q(location__lat__isnull=True)
+        | Q(location__lon__isnull=True)
+    )
+    addresses = {}
+    for model, ids_attribute in [(Order, 'order_ids'), (Restaurant, 'restaurant_ids')]:
+        objects = (
+            model.objects.filter(without_coords)
+            .exclude(address='')
+            .values_list('id', 'address')
+            .order_by('id')
+        )
+        for object_id, address in objects.iterator():
+            address_key = normalize_address(address)
+            if address_key not in addresses:
+                addresses[address_key] = UnlocatedAddress(address)
+            getattr(addresses[address_key], ids_attribute).append(object_id)
+    return addresses
+
+
+def get_known_locations(address_keys):
+    known_locations = {}
+    for batch_start in range(0, len(address_keys), UPDATE_BATCH_SIZE):
+        locations = Location.objects.filter(
+            address_key__in=address_keys[batch_start:batch_start + UPDATE_BATCH_SIZE],
+        )
+        known_locations.update((location.address_key, location) for location in locations)
+    return known_locations
+
+
+def get_recent_misses(address_keys):
+    cached_entries = cache.get_many([get_cache_key(key) for key in address_keys])
+    return {
+        address_key for address_key in address_keys
+        if isinstance(cached_entries.get(get_cache_key(address_key)), CachedMiss)
+        and cached_entries[get_cache_key(address_key)].retry_at > time.time()
+    }
+
+
+def geocode_many(addresses, workers, rate):
+    """Geocode addresses in a thread pool, yielding (address, coords or error).
+
+    Every call, retries included, waits for its turn under the rate limit.
+    Timeouts, outages and exceeded quota are retried after a pause.
+    """
+    rate_limiter = RateLimiter(rate)
+
+    def geocode(address):
+        for attempt in range(GEOCODE_RETRIES + 1):
+            rate_limiter.wait()
+            try:
+                return address, geocode_address(address)
+            except TRANSIENT_ERRORS as error:
+                if attempt == GEOCODE_RETRIES:
+                    return address, error
+            except GeocoderServiceError as error:
+                return address, error
+            time.sleep(GEOCODE_RETRY_DELAY * 2 ** attempt)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(geocode, addresses)
+
+
+@transaction.atomic
+def save_locations(unlocated_addresses, coords_by_key, known_locations):
+    """Store found coordinates and attach them to waiting orders and restaurants."""
+    new_locations = []
+    updated_locations = []
+    for address_key, coords in coords_by_key.items():
+        location = known_locations.get(address_key)
+        if location is None:
+            location = Location(
+                address=unlocated_addresses[address_key].address,
+                address_key=address_key,
+            )
+            new_locations.append(location)
+        else:
+            updated_locations.append(location)
+        location.lat, location.lon = coords
+        known_locations[address_key] = location
+
+    Location.objects.bulk_create(new_locations, batch_size=UPDATE_BATCH_SIZE)
+    if any(location.pk is None for location in new_locations):
+        # Backends not returning ids from bulk_create
+        known_locations.update(get_known_locations([location.address_key for location in new_locations]))
+    Location.objects.bulk_update(updated_locations, ['lat', 'lon'], batch_size=UPDATE_BATCH_SIZE)
+
+    orders = []
+    restaurants = []
+    for address_key in coords_by_key:
+        location = known_locations[address_key]
+        unlocated_address = unlocated_addresses[address_key]
+        orders.extend(
+            Order(id=order_id, location=location, version=F('version') + 1)
+            for order_id in unlocated_address.order_ids
+        )
+        restaurants.extend(
+            Restaurant(id=restaurant_id, location=location)
+            for restaurant_id in unlocated_address.restaurant_ids
+        )
+    Order.objects.bulk_update(orders, ['location', 'version'], batch_size=UPDATE_BATCH_SIZE)
+    Restaurant.objects.bulk_update(restaurants, ['location'], batch_size=UPDATE_BATCH_SIZE)
+
+    locations = [known_locations[address_key] for address_key in coords_by_key]
+    order_locations = [
+        known_locations[address_key] for address_key in coords_by_key
+        if unlocated_addresses[address_key].order_ids
+    ]
+    restaurant_locations = [
+        known_locations[address_key] for address_key in coords_by_key
+        if unlocated_addresses[address_key].restaurant_ids
+    ]
+    open_order_ids = list(
+        Order.objects
+        .filter(id__in=[order.id for order in orders])
+        .exclude(status='completed')
+        .values_list('id', flat=True)
+    )
+    OrderChange.objects.record(open_order_ids)
+
+    def refresh_caches():
+        for location in locations:
+            remember_location(location)
+        if restaurant_locations:
+            # bulk_update skips the signals doing this
+            invalidate_spatial_index()
+            forget_filled_distances()
+        fill_order_distances(order_locations)
+
+    transaction.on_commit(refresh_caches)
+    return len(orders), len(restaurants)
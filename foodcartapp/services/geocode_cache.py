@@ -0,0 +1,142 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import cache
+
+from foodcartapp.models import Location
+from foodcartapp.services.addresses import normalize_address
+from foodcartapp.services.geocode_metrics import increment
+
+
+# Bumped when cached location ids went stale, like after the merge of
+# duplicate locations in migration 0062
+CACHE_KEY_PREFIX = 'foodcartapp:geocode:v3:'
+SHARED_TTL = 30 * 24 * 60 * 60
+# Kept short, other workers' copies can't be invalidated
+LOCAL_TTL = 5 * 60
+LOCAL_MAX_SIZE = 10000
+# Addresses the geocoder couldn't find are retried after this delay,
+# doubled after every new failure
+MISSING_RETRY_DELAY = 10 * 60
+MISSING_MAX_RETRY_DELAY = 24 * 60 * 60
+
+CachedLocation = namedtuple('CachedLocation', ['location_id', 'lat', 'lon'])
+CachedMiss = namedtuple('CachedMiss', ['failures', 'retry_at'])
+
+
+class LocalCache:
+    """Thread-safe LRU with expiring entries."""
+
+    def __init__(self, max_size=LOCAL_MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local_cache = LocalCache()
+
+
+def get_cache_key(address):
+    return CACHE_KEY_PREFIX + hashlib.sha1(normalize_address(address).encode()).hexdigest()
+
+
+def lookup_address(address):
+    """What is known about the address without asking the geocoder.
+
+    Addresses are compared by their normalized form. Looks in this
+    worker's LRU, then in the shared cache, then in the Location table.
+    Returns a CachedLocation, a CachedMiss while the address waits for
+    its retry after the geocoder couldn't find it, or None. A deleted
+    location is forgotten by every worker's shared cache at once, but may
+    stay in other workers' LRU for LOCAL_TTL, so check the id before
+    relying on it.
+    """
+    key = get_cache_key(address)
+    entry = _local_cache.get(key)
+    if entry is not None:
+        return get_live_entry(entry, 'local_hits')
+
+    entry = cache.get(key)
+    if entry is not None:
+        _local_cache.set(key, entry, LOCAL_TTL)
+        return get_live_entry(entry, 'shared_hits')
+
+    location = (
+        Location.objects
+        .filter(
+            address_key=normalize_address(address),
+            lat__isnull=False,
+            lon__isnull=False,
+        )
+        .first()
+    )
+    if location:
+        increment('lookups:db_hits')
+        return remember_location(location)
+    increment('lookups:misses')
+    return None
+
+
+def get_live_entry(entry, hit_name):
+    if isinstance(entry, CachedMiss) and entry.retry_at <= time.time():
+        increment('lookups:misses')
+        return None
+    increment('lookups:' + ('missing_hits' if isinstance(entry, CachedMiss) else hit_name))
+    return entry
+
+
+def remember_location(location):
+    entry = CachedLocation(location.id, location.lat, location.lon)
+    key = get_cache_key(location.address)
+    cache.set(key, entry, SHARED_TTL)
+    _local_cache.set(key, entry, LOCAL_TTL)
+    return entry
+
+
+def remember_miss(address):
+    key = get_cache_key(address)
+    previous_entry = cache.get(key)
+    failures = 1
+    if isinstance(previous_entry, CachedMiss):
+        failures = previous_entry.failures + 1
+    delay = min(MISSING_RETRY_DELAY * 2 ** (failures - 1), MISSING_MAX_RETRY_DELAY)
+    entry = CachedMiss(failures, time.time() + delay)
+    # Outlives the retry delay, so the next failure backs off further
+    cache.set(key, entry, SHARED_TTL)
+    _local_cache.set(key, entry, min(LOCAL_TTL, delay))
+    return entry
+
+
+def forget_address(address):
+    key = get_cache_key(address)
+    cache.delete(key)
+    _local_cache.delete(key)
@@ -0,0 +1,232 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from foodcartapp.models import GeocodeTask
+
+
+CACHE_KEY_PREFIX = 'foodcartapp:geocode-metrics:'
+# Counters are summed up in the process and added to the shared cache
+# this often by a background thread, not to pay a cache round trip for
+# every lookup. Processes see each other's counters only if the cache is
+# shared, under locmem every process reads just its own. The database
+# cache adds up with a get and a set, so flushes of several processes at
+# the same moment may lose some counts; memcached adds them up exactly.
+FLUSH_INTERVAL = 10
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+LOOKUP_OUTCOMES = ['local_hits', 'shared_hits', 'db_hits', 'missing_hits', 'misses']
+LOOKUP_HIT_OUTCOMES = ['local_hits', 'shared_hits', 'db_hits']
+GEOCODER_OUTCOMES = [
+    'found', 'not_found', 'timeout', 'unavailable', 'circuit_open',
+    'quota_exceeded', 'auth_failed', 'parse_error', 'http_error',
+]
+TASK_OUTCOMES = ['done', 'retried', 'failed']
+
+logger = logging.getLogger(__name__)
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_flushing_started = False
+_flusher_pid = None
+
+
+def get_bucket(duration_ms):
+    for bucket in LATENCY_BUCKETS_MS:
+        if duration_ms <= bucket:
+            return str(bucket)
+    return 'inf'
+
+
+def flush_safely():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Не удалось сохранить счётчики геокодирования')
+
+
+def run_flusher():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        close_old_connections()
+        flush_safely()
+
+
+def start_flushing():
+    """Flush the counters in the background and at exit.
+
+    Only for the processes serving the site or the queue. Tests and one-off
+    commands don't call it, so their counters don't end up in the real cache
+    after the test database is gone; a command that wants to keep its
+    counters calls flush() itself.
+    """
+    global _flushing_started
+
+    with _pending_lock:
+        if _flushing_started:
+            return
+        _flushing_started = True
+    atexit.register(flush_safely)
+
+
+def increment(name, value=1):
+    global _flusher_pid
+
+    with _pending_lock:
+        _pending[name] += value
+        # Started on first use in every process: threads don't survive
+        # the fork of gunicorn workers
+        start_flusher = _flushing_started and _flusher_pid != os.getpid()
+        if start_flusher:
+            _flusher_pid = os.getpid()
+    if start_flusher:
+        threading.Thread(target=run_flusher, name='geocode-metrics-flusher', daemon=True).start()
+
+
+def observe_latency(name, seconds):
+    duration_ms = seconds * 1000
+    increment(f'{name}:latency:{get_bucket(duration_ms)}')
+    # Microseconds, the cache can only add up integers
+    increment(f'{name}:latency:sum_us', round(duration_ms * 1000))
+
+
+@contextmanager
+def measure_latency(name):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_latency(name, time.perf_counter() - started_at)
+
+
+def flush():
+    """Add the counters of this process to the shared ones.
+
+    The counters not added because the cache failed are kept for the next
+    flush.
+    """
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    flushed_names = set()
+    try:
+        for name, value in pending.items():
+            key = CACHE_KEY_PREFIX + name
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.add(key, 0, None)
+                cache.incr(key, value)
+            flushed_names.add(name)
+    finally:
+        if len(flushed_names) < len(pending):
+            with _pending_lock:
+                _pending.update({
+                    name: value for name, value in pending.items() if name not in flushed_names
+                })
+
+
+def get_latency_names(name):
+    return [f'{name}:latency:{bucket}' for bucket in [*map(str, LATENCY_BUCKETS_MS), 'inf', 'sum_us']]
+
+
+def get_metric_names():
+    names = [f'lookups:{outcome}' for outcome in LOOKUP_OUTCOMES]
+    names += get_latency_names('checkout')
+    for backend in settings.GEOCODER_BACKENDS:
+        names += [f'geocoders:{backend}:{outcome}' for outcome in GEOCODER_OUTCOMES]
+        names += get_latency_names(f'geocoders:{backend}')
+    names += [f'tasks:{outcome}' for outcome in TASK_OUTCOMES]
+    return names
+
+
+def get_percentile(buckets, count, percentile):
+    """Upper bound of the bucket the percentile falls into."""
+    seen = 0
+    for bucket, bucket_count in buckets.items():
+        seen += bucket_count
+        if seen >= count * percentile:
+            return None if bucket == 'inf' else int(bucket)
+    return None
+
+
+def get_latency(values, name):
+    buckets = {
+        bucket: values.get(f'{name}:latency:{bucket}', 0)
+        for bucket in [*map(str, LATENCY_BUCKETS_MS), 'inf']
+    }
+    count = sum(buckets.values())
+    if not count:
+        return {'count': 0, 'avg_ms': None, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'buckets': buckets}
+    return {
+        'count': count,
+        'avg_ms': round(values.get(f'{name}:latency:sum_us', 0) / count / 1000, 3),
+        'p50_ms': get_percentile(buckets, count, 0.5),
+        'p95_ms': get_percentile(buckets, count, 0.95),
+        'p99_ms': get_percentile(buckets, count, 0.99),
+        'buckets': buckets,
+    }
+
+
+def get_queue_depth():
+    now = timezone.now()
+    pending_tasks = GeocodeTask.objects.filter(status='pending')
+    oldest_task = pending_tasks.order_by('created_at').first()
+    return {
+        'pending': pending_tasks.count(),
+        'due': pending_tasks.filter(run_after__lte=now).count(),
+        'failed': GeocodeTask.objects.filter(status='failed').count(),
+        'oldest_pending_seconds': (
+            round((now - oldest_task.created_at).total_seconds()) if oldest_task else None
+        ),
+    }
+
+
+def get_metrics():
+    """Geocoding counters of all processes and the queue depth.
+
+    Latency percentiles are the upper bounds of the histogram buckets
+    they fall into.
+    """
+    flush()
+    names = get_metric_names()
+    cached_values = cache.get_many([CACHE_KEY_PREFIX + name for name in names])
+    values = {name: cached_values.get(CACHE_KEY_PREFIX + name, 0) for name in names}
+
+    lookups = {outcome: values[f'lookups:{outcome}'] for outcome in LOOKUP_OUTCOMES}
+    hits = sum(lookups[outcome] for outcome in LOOKUP_HIT_OUTCOMES)
+    total_lookups = sum(lookups.values())
+    lookups['hit_ratio'] = round(hits / total_lookups, 4) if total_lookups else None
+
+    geocoders = {}
+    for backend in settings.GEOCODER_BACKENDS:
+        outcomes = {outcome: values[f'geocoders:{backend}:{outcome}'] for outcome in GEOCODER_OUTCOMES}
+        geocoders[backend] = {
+            'calls': sum(outcomes.values()),
+            'outcomes': outcomes,
+            'latency': get_latency(values, f'geocoders:{backend}'),
+        }
+
+    return {
+        # Time the order checkout spends locating the address
+        'checkout': get_latency(values, 'checkout'),
+        'lookups': lookups,
+        'geocoders': geocoders,
+        'tasks': {outcome: values[f'tasks:{outcome}'] for outcome in TASK_OUTCOMES},
+        'queue': get_queue_depth(),
+    }
+
+
+def reset_metrics():
+    with _pending_lock:
+        _pending.clear()
+    cache.delete_many([CACHE_KEY_PREFIX + name for name in get_metric_names()])
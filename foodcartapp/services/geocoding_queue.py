@@ -0,0 +1,162 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from geopy.exc import GeocoderServiceError
+
+from foodcartapp.models import GeocodeTask, Location, Order, OrderChange
+from foodcartapp.services.addresses import normalize_address
+from foodcartapp.services.distance_cache import fill_order_distances
+from foodcartapp.services.geocode_cache import (
+    CachedLocation, forget_address, lookup_address, remember_location, remember_miss,
+)
+from foodcartapp.services.geocode_metrics import increment, measure_latency
+from foodcartapp.services.geolocation import geocode_address
+
+
+# A task of a worker that died midway is picked up again after that
+TASK_LEASE = timedelta(minutes=2)
+MAX_ATTEMPTS = 5
+# Doubled after every failed attempt
+RETRY_DELAY = timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
+
+def locate_address(address):
+    """Location of an already geocoded address, None for unknown ones.
+
+    Unknown addresses are queued for the worker, except the ones the
+    geocoder recently couldn't find: they wait for their retry time.
+    """
+    with measure_latency('checkout'):
+        entry = lookup_address(address)
+        if isinstance(entry, CachedLocation):
+            # The cached id may belong to a location deleted or merged since
+            location = Location.objects.filter(
+                id=entry.location_id,
+                address_key=normalize_address(address),
+            ).first()
+            if location:
+                return location
+            forget_address(address)
+            entry = lookup_address(address)
+            if isinstance(entry, CachedLocation):
+                return Location.objects.get(id=entry.location_id)
+        if entry is None:
+            enqueue_geocoding(address)
+        return None
+
+
+def enqueue_geocoding(address):
+    task, created = GeocodeTask.objects.get_or_create(address=address)
+    if not created and task.status != 'pending':
+        GeocodeTask.objects.filter(id=task.id).update(
+            status='pending',
+            attempts=0,
+            run_after=timezone.now(),
+        )
+
+
+def get_pending_addresses(addresses):
+    return set(
+        GeocodeTask.objects
+        .filter(status='pending', address__in=addresses)
+        .values_list('address', flat=True)
+    )
+
+
+@transaction.atomic
+def claim_tasks(limit):
+    """Lease due tasks to this worker, skipping the ones other workers hold.
+
+    A task whose lease ran out that many times, because its worker died
+    on it every time, fails instead of being leased again.
+    """
+    now = timezone.now()
+    tasks = list(
+        GeocodeTask.objects
+        .select_for_update(skip_locked=True)
+        .filter(status='pending', run_after__lte=now)
+        .order_by('run_after', 'id')[:limit]
+    )
+    abandoned_ids = [task.id for task in tasks if task.attempts >= MAX_ATTEMPTS]
+    if abandoned_ids:
+        GeocodeTask.objects.filter(id__in=abandoned_ids).update(
+            status='failed',
+            last_error='Воркер не закончил ни одну попытку',
+        )
+        increment('tasks:failed', len(abandoned_ids))
+    tasks = [task for task in tasks if task.id not in abandoned_ids]
+    GeocodeTask.objects.filter(id__in=[task.id for task in tasks]).update(
+        run_after=now + TASK_LEASE,
+        attempts=F('attempts') + 1,
+    )
+    for task in tasks:
+        task.attempts += 1
+    return tasks
+
+
+def retry_task(task, error):
+    """Put the task off for a doubled delay, or fail it after MAX_ATTEMPTS."""
+    task.last_error = str(error) or error.__class__.__name__
+    if task.attempts >= MAX_ATTEMPTS:
+        task.status = 'failed'
+    else:
+        task.run_after = timezone.now() + RETRY_DELAY * 2 ** (task.attempts - 1)
+    task.save(update_fields=['status', 'run_after', 'last_error'])
+    increment('tasks:failed' if task.status == 'failed' else 'tasks:retried')
+
+
+def run_task(task):
+    """Geocode the address and attach it to the orders waiting for it.
+
+    Returns True if the address was found. Any error puts the task off
+    for a retry, so one bad address can't stop the worker.
+    """
+    try:
+        return locate_task_address(task)
+    except Exception as error:
+        if not isinstance(error, GeocoderServiceError):
+            # Geocoder errors are already logged by the geocoder chain
+            logger.exception("Can't geocode %s", task.address)
+        retry_task(task, error)
+        return False
+
+
+def locate_task_address(task):
+    entry = lookup_address(task.address)
+    if isinstance(entry, CachedLocation):
+        coords = entry.lat, entry.lon
+    else:
+        coords = geocode_address(task.address)
+
+    with transaction.atomic():
+        waiting_orders = Order.objects.filter(address=task.address, location__isnull=True)
+        order_ids = list(waiting_orders.values_list('id', flat=True))
+        if coords:
+            location, _ = Location.objects.get_or_create(
+                address_key=normalize_address(task.address),
+                defaults={'address': task.address},
+            )
+            location.lat, location.lon = coords
+            location.save()
+            waiting_orders.filter(id__in=order_ids).update(
+                location=location,
+                version=F('version') + 1,
+            )
+            fill_order_distances([location])
+            transaction.on_commit(lambda: remember_location(location))
+            task.status = 'done'
+            task.last_error = ''
+        else:
+            transaction.on_commit(lambda: remember_miss(task.address))
+            task.status = 'failed'
+            task.last_error = 'Геокодер не нашёл адрес'
+        task.save(update_fields=['status', 'last_error'])
+        increment(f'tasks:{task.status}')
+        # The dashboard shows these orders as waiting for coordinates until now
+        OrderChange.objects.record(order_ids)
+    return bool(coords)
@@ -1,49 +1,234 @@
+import logging
+import random
+import threading
+import time
+
 import requests
 from django.conf import settings
-from foodcartapp.models import Location
-
-from geopy.geocoders import Yandex
-
-
-def fetch_coordinates(api_key, address):
-    url = "https://geocode-maps.yandex.ru/1.x"
-    params = {"apikey": api_key, "geocode": address, "format": "json"}
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        geo_data = response.json()
-        coords = geo_data["response"]["GeoObjectCollection"]["featureMember"][0][
-            "GeoObject"
-        ]["Point"]["pos"]
-        lon, lat = map(float, coords.split(" "))
+from geopy.exc import (
+    GeocoderAuthenticationFailure,
+    GeocoderParseError,
+    GeocoderQuotaExceeded,
+    GeocoderServiceError,
+    GeocoderTimedOut,
+    GeocoderUnavailable,
+)
+from requests.adapters import HTTPAdapter
+
+from foodcartapp.services.gazetteer import GazetteerGeocoder
+from foodcartapp.services.geocode_metrics import increment, measure_latency
+
+
+GEOCODER_API_URL = "https://geocode-maps.yandex.ru/1.x"
+# Seconds to connect and to wait for the answer
+GEOCODER_TIMEOUT = (3.05, 5)
+GEOCODER_RETRIES = 2
+GEOCODER_RETRY_DELAY = 0.5
+# Enough for every thread of a gunicorn worker or the backfill pool
+GEOCODER_POOL_SIZE = 16
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+class GeocoderCircuitOpen(GeocoderUnavailable):
+    pass
+
+
+# Most specific first, the later ones are their base classes
+ERROR_OUTCOMES = [
+    (GeocoderCircuitOpen, "circuit_open"),
+    (GeocoderTimedOut, "timeout"),
+    (GeocoderQuotaExceeded, "quota_exceeded"),
+    (GeocoderAuthenticationFailure, "auth_failed"),
+    (GeocoderParseError, "parse_error"),
+    (GeocoderUnavailable, "unavailable"),
+]
+
+
+def get_error_outcome(error):
+    for error_class, outcome in ERROR_OUTCOMES:
+        if isinstance(error, error_class):
+            return outcome
+    return "http_error"
+
+
+class CircuitBreaker:
+    """Stops calling a service after several failures in a row.
+
+    After reset_timeout one trial call is let through and the other calls
+    are still rejected right away: if the trial succeeds the calls go on as
+    usual, otherwise the breaker stays open for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Let a single trial call through, the others are rejected until its
+            # result is known or reset_timeout passes again
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class GeocoderClient:
+    """Yandex geocoder client reusing connections between calls."""
+
+    def __init__(self, api_key, api_url=GEOCODER_API_URL, timeout=GEOCODER_TIMEOUT,
+                 retries=GEOCODER_RETRIES, retry_delay=GEOCODER_RETRY_DELAY,
+                 circuit_breaker=None):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GEOCODER_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def geocode(self, address):
+        """Coordinates of the address, None if the geocoder doesn't know it.
+
+        Raises geopy's GeocoderServiceError subclasses when the geocoder
+        can't answer, GeocoderUnavailable right away while it is known to
+        be down.
+        """
+        if not self.circuit_breaker.allow_call():
+            raise GeocoderCircuitOpen("Геокодер недоступен, запросы временно не отправляются")
+        for attempt in range(self.retries + 1):
+            try:
+                coords = self.request(address)
+            except (GeocoderTimedOut, GeocoderUnavailable):
+                if attempt == self.retries:
+                    self.circuit_breaker.record_failure()
+                    raise
+            except GeocoderServiceError:
+                self.circuit_breaker.record_failure()
+                raise
+            else:
+                self.circuit_breaker.record_success()
+                return coords
+            # Full jitter, so retries of many workers don't come at once
+            time.sleep(random.uniform(0, self.retry_delay * 2 ** attempt))
+
+    def request(self, address):
+        params = {"apikey": self.api_key, "geocode": address, "format": "json"}
+        try:
+            response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+        except requests.Timeout as error:
+            raise GeocoderTimedOut(str(error))
+        except requests.RequestException as error:
+            raise GeocoderUnavailable(str(error))
+
+        if response.status_code in (401, 403):
+            raise GeocoderAuthenticationFailure(f"HTTP {response.status_code}")
+        if response.status_code == 429:
+            raise GeocoderQuotaExceeded(f"HTTP {response.status_code}")
+        if response.status_code >= 500:
+            raise GeocoderUnavailable(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise GeocoderServiceError(f"HTTP {response.status_code}")
+
+        try:
+            found_objects = response.json()["response"]["GeoObjectCollection"]["featureMember"]
+            if not found_objects:
+                return None
+            lon, lat = map(float, found_objects[0]["GeoObject"]["Point"]["pos"].split(" "))
+        except (KeyError, IndexError, TypeError, ValueError) as error:
+            raise GeocoderParseError(f"Непонятный ответ геокодера: {error!r}")
         return lat, lon
-    except (IndexError, KeyError, ValueError, requests.RequestException):
-        return None, None
 
 
-def get_or_update_coordinates(obj, address, coords_cache, updated_objects):
-    if address in coords_cache:
-        coords = coords_cache[address]
-    else:
-        geolocator = Yandex(api_key=settings.YANDEX_GEOCODER_API_KEY)
-        location, _ = Location.objects.get_or_create(address=address)
+class GeocoderChain:
+    """Asks the geocoders in turn until one of them knows the address.
+
+    A failing geocoder doesn't stop the chain, but if none found the
+    address and some failed, the error is raised so the caller retries
+    later instead of taking the address for unknown. Takes (name,
+    geocoder) pairs, the names label the geocoding metrics.
+    """
 
-        if not location.lat or not location.lon:
+    def __init__(self, geocoders):
+        self.geocoders = geocoders
+
+    def geocode(self, address):
+        error = None
+        for name, geocoder in self.geocoders:
             try:
-                geo = geolocator.geocode(address)
-                if geo:
-                    location.lat = geo.latitude
-                    location.lon = geo.longitude
-                    location.save()
-            except Exception as e:
-                print(f"Geocoding error: {e}")
-                coords_cache[address] = None
-                return
-
-        coords = (location.lat, location.lon) if location.lat and location.lon else None
-        coords_cache[address] = coords
-
-    if coords:
-        location = Location.objects.get(address=address)
-        obj.location = location
-        updated_objects.append(obj)
\ No newline at end of file
+                with measure_latency(f"geocoders:{name}"):
+                    coords = geocoder.geocode(address)
+            except GeocoderServiceError as geocoder_error:
+                increment(f"geocoders:{name}:{get_error_outcome(geocoder_error)}")
+                logger.warning("Geocoder %s failed on %r: %r", name, address, geocoder_error)
+                error = geocoder_error
+                continue
+            increment(f"geocoders:{name}:{'found' if coords else 'not_found'}")
+            if coords:
+                return coords
+        if error:
+            raise error
+        return None
+
+
+def create_gazetteer_geocoder():
+    if not settings.GEOCODER_GAZETTEER_PATH:
+        return None
+    return GazetteerGeocoder.from_file(settings.GEOCODER_GAZETTEER_PATH)
+
+
+def create_yandex_geocoder():
+    return GeocoderClient(settings.YANDEX_GEOCODER_API_KEY)
+
+
+GEOCODER_BACKENDS = {
+    "gazetteer": create_gazetteer_geocoder,
+    "yandex": create_yandex_geocoder,
+}
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    """Chain of the GEOCODER_BACKENDS, created once per process."""
+    global _geocoder
+
+    with _geocoder_lock:
+        if _geocoder is None:
+            geocoders = [
+                (name, GEOCODER_BACKENDS[name]()) for name in settings.GEOCODER_BACKENDS
+            ]
+            _geocoder = GeocoderChain([(name, geocoder) for name, geocoder in geocoders if geocoder])
+        return _geocoder
+
+
+def geocode_address(address):
+    """Coordinates of the address, None if the geocoder doesn't know it.
+
+    Raises geopy's GeocoderServiceError when the geocoder is unavailable.
+    """
+    return get_geocoder().geocode(address)
+
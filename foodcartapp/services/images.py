@@ -0,0 +1,203 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from foodcartapp.models import Product, invalidate_menu_caches
+
+
+# Widths of the resized copies, the admin list shows thumbnails at 50px
+IMAGE_SIZES = {
+    'thumbnail': 100,
+    'card': 400,
+    'full': 1200,
+}
+IMAGE_FORMATS = {
+    # method 6 saves a few percent at twice the encoding time
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'product_variants'
+# Younger copies may be made right now for a product not saved yet
+UNUSED_VARIANT_MIN_AGE = timedelta(hours=1)
+
+logger = logging.getLogger(__name__)
+
+# One image at a time, the copies don't take the CPU from the requests
+_encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-variants')
+
+
+def resize_image(image, width):
+    """The image scaled down to the width, never up."""
+    if image.width <= width:
+        return image
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def encode_image(image, image_format):
+    pil_format, options = IMAGE_FORMATS[image_format]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no transparency, it goes white like the site background
+        background = Image.new('RGB', image.size, 'white')
+        rgba_image = image.convert('RGBA')
+        background.paste(rgba_image, mask=rgba_image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def save_variant(content, image_format, storage=default_storage):
+    """Store a resized copy under a name made of its content hash.
+
+    Equal content gets the same name, so the files can be cached forever
+    and a copy already made isn't written again.
+    """
+    content_hash = hashlib.sha256(content).hexdigest()[:20]
+    name = f'{VARIANTS_DIR}/{content_hash}.{image_format}'
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name
+
+
+def make_image_variants(image_name, storage=default_storage):
+    """Resized WebP and JPEG copies of the image.
+
+    Returns {"source": image_name, "sizes": {size: {"width": ..., "webp":
+    name, "jpeg": name}}}. Raises OSError if the image can't be read.
+    """
+    with storage.open(image_name, 'rb') as image_file:
+        image = Image.open(image_file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    sizes = {}
+    for size, width in IMAGE_SIZES.items():
+        resized_image = resize_image(image, width)
+        sizes[size] = {'width': resized_image.width}
+        for image_format in IMAGE_FORMATS:
+            content = encode_image(resized_image, image_format)
+            sizes[size][image_format] = save_variant(content, image_format, storage)
+    return {'source': image_name, 'sizes': sizes}
+
+
+def get_variant_names(image_variants):
+    return {
+        variant[image_format]
+        for variant in image_variants.get('sizes', {}).values()
+        for image_format in IMAGE_FORMATS
+        if image_format in variant
+    }
+
+
+def delete_unused_variants(names, storage=default_storage):
+    """Delete the copies no product refers to, returns how many were deleted.
+
+    Copies are shared by products with equal images, so every product is
+    checked. Recent copies are kept, they may be about to be saved.
+    """
+    used_names = set()
+    for image_variants in Product.objects.values_list('image_variants', flat=True):
+        used_names |= get_variant_names(image_variants)
+    made_before = timezone.now() - UNUSED_VARIANT_MIN_AGE
+    deleted_count = 0
+    for name in set(names) - used_names:
+        try:
+            if storage.get_modified_time(name) > made_before:
+                continue
+            storage.delete(name)
+        except OSError:
+            continue
+        deleted_count += 1
+    return deleted_count
+
+
+def delete_all_unused_variants(storage=default_storage):
+    try:
+        _, file_names = storage.listdir(VARIANTS_DIR)
+    except FileNotFoundError:
+        return 0
+    return delete_unused_variants([f'{VARIANTS_DIR}/{name}' for name in file_names], storage)
+
+
+def update_image_variants(product_id, image_name):
+    """Make the copies of a newly uploaded image, drop the previous ones."""
+    try:
+        image_variants = make_image_variants(image_name)
+    except OSError:
+        logger.warning(
+            "Can't make copies of image %s of product %s",
+            image_name,
+            product_id,
+            exc_info=True,
+        )
+        return
+    previous_variants = (
+        Product.objects.filter(id=product_id).values_list('image_variants', flat=True).first()
+    )
+    # Only if the image wasn't replaced meanwhile
+    if not Product.objects.filter(id=product_id, image=image_name).update(image_variants=image_variants):
+        return
+    invalidate_menu_caches()
+    if previous_variants:
+        delete_unused_variants(get_variant_names(previous_variants) - get_variant_names(image_variants))
+
+
+def run_in_background(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception("Image copies task %s failed", function.__name__)
+    finally:
+        # The thread outlives requests, nobody else closes its connection
+        connection.close()
+
+
+def schedule_image_variants(product):
+    """Make the copies of a newly uploaded image after the commit, in the background.
+
+    The admin doesn't wait for the encoding, until it's done the site shows
+    the original. Copies lost to a restart are made by backfill_image_variants.
+    """
+    if not product.image or product.has_image_variants:
+        return
+    product_id = product.id
+    image_name = product.image.name
+    transaction.on_commit(
+        lambda: _encoder.submit(run_in_background, update_image_variants, product_id, image_name)
+    )
+
+
+def schedule_variants_cleanup(image_variants):
+    names = get_variant_names(image_variants)
+    if names:
+        transaction.on_commit(
+            lambda: _encoder.submit(run_in_background, delete_unused_variants, names)
+        )
+
+
+def get_srcset(image_variants, storage=default_storage):
+    """srcset attribute values by format, e.g. {"webp": "a.webp 100w, b.webp 400w"}.
+
+    Copies of the same width, made from a small image, are listed once.
+    """
+    srcset = {}
+    for image_format in IMAGE_FORMATS:
+        candidates = {}
+        for variant in image_variants.get('sizes', {}).values():
+            candidates.setdefault(variant['width'], storage.url(variant[image_format]))
+        if candidates:
+            srcset[image_format] = ', '.join(
+                f'{url} {width}w' for width, url in sorted(candidates.items())
+            )
+    return srcset
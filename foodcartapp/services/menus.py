@@ -0,0 +1,130 @@
+import hashlib
+from collections import defaultdict
+
+from django.core.cache import cache
+
+from foodcartapp.models import Restaurant, RestaurantMenuItem
+from foodcartapp.renderers import dumps
+from foodcartapp.services.cache_versions import bump_version, get_new_version
+from foodcartapp.services.catalog import serialize_product
+from foodcartapp.services.compression import CompressedPayload
+
+
+MENU_VERSION_CACHE_KEY_PREFIX = 'foodcartapp:menu_version:'
+MENU_CACHE_KEY_PREFIX = 'foodcartapp:menu:'
+MENUS_CACHE_KEY_PREFIX = 'foodcartapp:menus:'
+# Joined menus are keyed by the versions of all of them, so old ones are
+# never invalidated, just left to expire
+MENUS_TTL = 24 * 60 * 60
+
+
+def get_menu_versions(restaurant_ids):
+    version_keys = {
+        restaurant_id: f'{MENU_VERSION_CACHE_KEY_PREFIX}{restaurant_id}'
+        for restaurant_id in restaurant_ids
+    }
+    cached_versions = cache.get_many(version_keys.values())
+    versions = {}
+    for restaurant_id, version_key in version_keys.items():
+        if version_key not in cached_versions:
+            cache.add(version_key, get_new_version(), timeout=None)
+            cached_versions[version_key] = cache.get(version_key, 0)
+        versions[restaurant_id] = cached_versions[version_key]
+    return versions
+
+
+def build_menus(restaurants, versions):
+    products_by_restaurant = defaultdict(list)
+    menu_items = (
+        RestaurantMenuItem.objects
+        .filter(restaurant__in=restaurants, availability=True)
+        .select_related('product__category')
+        .order_by('product_id')
+    )
+    for menu_item in menu_items:
+        products_by_restaurant[menu_item.restaurant_id].append(menu_item.product)
+
+    return {
+        restaurant.id: CompressedPayload(dumps({
+            "id": restaurant.id,
+            "name": restaurant.name,
+            "address": restaurant.address,
+            "menu_version": versions[restaurant.id],
+            "products": [
+                serialize_product(product)
+                for product in products_by_restaurant[restaurant.id]
+            ],
+        }))
+        for restaurant in restaurants
+    }
+
+
+def get_menus(restaurant_ids):
+    """Menu snapshots of the restaurants that exist, by restaurant id.
+
+    A snapshot is built once per menu version and kept in the shared
+    cache. The version is bumped on every change of the restaurant, its
+    menu or the products in it, so a snapshot built from data read
+    before a change is stored under an outdated key and never served.
+    """
+    versions = get_menu_versions(restaurant_ids)
+    menu_keys = {
+        restaurant_id: f'{MENU_CACHE_KEY_PREFIX}{restaurant_id}:{version}'
+        for restaurant_id, version in versions.items()
+    }
+    cached_menus = cache.get_many(menu_keys.values())
+    menus = {
+        restaurant_id: cached_menus[menu_key]
+        for restaurant_id, menu_key in menu_keys.items()
+        if menu_key in cached_menus
+    }
+
+    missing_ids = [restaurant_id for restaurant_id in restaurant_ids if restaurant_id not in menus]
+    if missing_ids:
+        restaurants = list(Restaurant.objects.filter(id__in=missing_ids))
+        built_menus = build_menus(restaurants, versions)
+        cache.set_many(
+            {menu_keys[restaurant_id]: menu for restaurant_id, menu in built_menus.items()},
+            timeout=None,
+        )
+        menus.update(built_menus)
+    return menus
+
+
+def get_menu(restaurant_id):
+    """Menu snapshot of the restaurant, None if there is no such restaurant."""
+    return get_menus([restaurant_id]).get(restaurant_id)
+
+
+def get_all_menus():
+    """Menus of all restaurants as one payload.
+
+    The snapshots are joined without parsing them again, and the joined
+    payload is cached for the current set of menu versions.
+    """
+    restaurant_ids = list(Restaurant.objects.order_by('id').values_list('id', flat=True))
+    versions = get_menu_versions(restaurant_ids)
+    versions_hash = hashlib.sha1(dumps(sorted(versions.items()))).hexdigest()
+    cache_key = f'{MENUS_CACHE_KEY_PREFIX}{versions_hash}'
+    payload = cache.get(cache_key)
+    if payload is None:
+        menus = get_menus(restaurant_ids)
+        contents = [
+            menus[restaurant_id].content
+            for restaurant_id in restaurant_ids
+            if restaurant_id in menus
+        ]
+        payload = CompressedPayload(b'[' + b','.join(contents) + b']')
+        cache.set(cache_key, payload, MENUS_TTL)
+    return payload
+
+
+def invalidate_menus(restaurant_ids):
+    for restaurant_id in set(restaurant_ids):
+        previous_version = bump_version(f'{MENU_VERSION_CACHE_KEY_PREFIX}{restaurant_id}')
+        if previous_version:
+            cache.delete(f'{MENU_CACHE_KEY_PREFIX}{restaurant_id}:{previous_version}')
+
+
+def invalidate_all_menus():
+    invalidate_menus(Restaurant.objects.values_list('id', flat=True))
@@ -0,0 +1,237 @@
+import heapq
+import math
+import threading
+from collections import defaultdict
+from itertools import islice
+
+from foodcartapp.models import Restaurant
+from foodcartapp.services.cache_versions import bump_version, get_version
+from foodcartapp.services.distances import paired_distances
+
+
+INDEX_VERSION_CACHE_KEY = 'foodcartapp:spatial_index_version'
+
+# About 5.5 km along a meridian, a few cells cover a whole city
+CELL_SIZE_DEGREES = 0.05
+# Lower bound of one degree length on the WGS-84 ellipsoid with a margin
+KM_PER_DEGREE_LAT = 110.5
+KM_PER_DEGREE_LON_AT_EQUATOR = 111.2
+EARTH_MEAN_RADIUS_KM = 6371.0088
+# Spherical distances differ from WGS-84 geodesic ones by less than 0.6%
+SPHERICAL_TOLERANCE = 1.01
+
+
+class RestaurantSpatialIndex:
+    """Restaurants bucketed into a lat/lon grid for nearest and radius queries.
+
+    Queries walk square rings of cells around the point and stop as soon as
+    no unvisited cell can hold anything closer than what was already found,
+    so only the restaurants around the point get their distances computed:
+    a cheap spherical one first, then the exact geodesic for the shortlist.
+    """
+
+    def __init__(self, points, cell_size=CELL_SIZE_DEGREES):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.points = {}
+        self.location_ids = {}
+        for restaurant_id, point in points:
+            if not point:
+                continue
+            self.points[restaurant_id] = point
+            self.cells[self.get_cell(point)].append(restaurant_id)
+
+    @classmethod
+    def build(cls):
+        restaurants = list(Restaurant.objects.select_related('location'))
+        index = cls(
+            (restaurant.id, restaurant.location.coords if restaurant.location else None)
+            for restaurant in restaurants
+        )
+        index.location_ids = {
+            restaurant.id: restaurant.location_id for restaurant in restaurants
+        }
+        return index
+
+    def get_cell(self, point):
+        lat, lon = point
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def iter_ring(self, center, ring):
+        row, column = center
+        if ring == 0:
+            yield center
+            return
+        for offset in range(-ring, ring + 1):
+            yield row - ring, column + offset
+            yield row + ring, column + offset
+        for offset in range(-ring + 1, ring):
+            yield row + offset, column - ring
+            yield row + offset, column + ring
+
+    def get_ring_min_km(self, point, ring):
+        """How close a restaurant from the given ring or further can be."""
+        if ring <= 1:
+            return 0
+        lat = min(abs(point[0]) + (ring + 1) * self.cell_size, 89.9)
+        km_per_degree = min(
+            KM_PER_DEGREE_LAT,
+            KM_PER_DEGREE_LON_AT_EQUATOR * math.cos(math.radians(lat)),
+        )
+        return (ring - 1) * self.cell_size * km_per_degree
+
+    def iter_nearby(self, point, allowed_ids=None, max_km=None):
+        """Yield (restaurant_id, km) pairs by increasing spherical distance."""
+        if not self.points:
+            return
+        center = self.get_cell(point)
+        found = []
+        visited_cells = 0
+        ring = 0
+        while visited_cells < len(self.cells):
+            ring_min_km = self.get_ring_min_km(point, ring)
+            if max_km is not None and ring_min_km > max_km:
+                break
+            while found and found[0][0] <= ring_min_km:
+                yield heapq.heappop(found)[::-1]
+
+            if 8 * ring > len(self.cells) - visited_cells:
+                # The rings got wider than the rest of the grid, take it all
+                restaurant_ids = [
+                    restaurant_id
+                    for cell, cell_restaurant_ids in self.cells.items()
+                    if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= ring
+                    for restaurant_id in cell_restaurant_ids
+                ]
+                visited_cells = len(self.cells)
+            else:
+                restaurant_ids = []
+                for cell in self.iter_ring(center, ring):
+                    cell_restaurant_ids = self.cells.get(cell)
+                    if cell_restaurant_ids:
+                        restaurant_ids.extend(cell_restaurant_ids)
+                        visited_cells += 1
+            ring += 1
+
+            for restaurant_id in restaurant_ids:
+                if allowed_ids is not None and restaurant_id not in allowed_ids:
+                    continue
+                km = get_spherical_km(point, self.points[restaurant_id])
+                if max_km is None or km <= max_km:
+                    heapq.heappush(found, (km, restaurant_id))
+
+        while found:
+            yield heapq.heappop(found)[::-1]
+
+    def get_candidates(self, point, k=None, allowed_ids=None, max_km=None):
+        """Restaurants that may be among the k nearest within max_km.
+
+        Spherical distances are off by up to half a percent, so the list is
+        widened by SPHERICAL_TOLERANCE and has to be refined with exact ones.
+        """
+        if k is None and max_km is None:
+            return [
+                restaurant_id for restaurant_id in self.points
+                if allowed_ids is None or restaurant_id in allowed_ids
+            ]
+        if max_km is not None:
+            max_km *= SPHERICAL_TOLERANCE
+        candidates = []
+        kth_km = None
+        for restaurant_id, km in self.iter_nearby(point, allowed_ids, max_km):
+            if kth_km is not None and km > kth_km * SPHERICAL_TOLERANCE ** 2:
+                break
+            candidates.append(restaurant_id)
+            if k is not None and len(candidates) == k:
+                kth_km = km
+        return candidates
+
+    def nearest_many(self, queries, k=None, max_km=None):
+        """Exact nearest restaurants for many (point, allowed_ids) at once.
+
+        Candidates of all queries are refined with a single batched
+        geodesic computation. Returns a list of [(restaurant_id, km), ...]
+        sorted by distance for every query.
+        """
+        query_rows = []
+        restaurant_ids = []
+        for row, (point, allowed_ids) in enumerate(queries):
+            if not point:
+                continue
+            candidates = self.get_candidates(point, k, allowed_ids, max_km)
+            query_rows.extend([row] * len(candidates))
+            restaurant_ids.extend(candidates)
+
+        results = [[] for _ in queries]
+        if not restaurant_ids:
+            return results
+        distances = paired_distances(
+            [queries[row][0] for row in query_rows],
+            [self.points[restaurant_id] for restaurant_id in restaurant_ids],
+        )
+        for row, restaurant_id, km in zip(query_rows, restaurant_ids, distances.tolist()):
+            if max_km is None or km <= max_km:
+                results[row].append((restaurant_id, km))
+        for nearby in results:
+            nearby.sort(key=lambda pair: pair[1])
+            if k is not None:
+                del nearby[k:]
+        return results
+
+    def nearest(self, point, k=None, allowed_ids=None, max_km=None):
+        return self.nearest_many([(point, allowed_ids)], k=k, max_km=max_km)[0]
+
+    def within(self, point, radius_km, allowed_ids=None):
+        return self.nearest(point, allowed_ids=allowed_ids, max_km=radius_km)
+
+    def get_distances(self, pairs):
+        """Exact km for (point, restaurant_id) pairs, None where unknown."""
+        known_rows = [
+            row for row, (point, restaurant_id) in enumerate(pairs)
+            if point and restaurant_id in self.points
+        ]
+        distances = [None] * len(pairs)
+        if not known_rows:
+            return distances
+        known_distances = paired_distances(
+            [pairs[row][0] for row in known_rows],
+            [self.points[pairs[row][1]] for row in known_rows],
+        )
+        for row, km in zip(known_rows, known_distances.tolist()):
+            distances[row] = km
+        return distances
+
+
+def get_spherical_km(point1, point2):
+    lat1, lon1 = map(math.radians, point1)
+    lat2, lon2 = map(math.radians, point2)
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_MEAN_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_spatial_index():
+    """Per-process index, rebuilt after any restaurant moves."""
+    global _index, _index_version
+
+    version = get_version(INDEX_VERSION_CACHE_KEY)
+    with _index_lock:
+        if _index is None or version != _index_version:
+            _index = RestaurantSpatialIndex.build()
+            _index_version = version
+        return _index
+
+
+def invalidate_spatial_index():
+    global _index
+
+    bump_version(INDEX_VERSION_CACHE_KEY)
+    with _index_lock:
+        _index = None
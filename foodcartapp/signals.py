@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Banner, Location, Order, OrderChange, Product, ProductCategory, Restaurant, RestaurantMenuItem,
+)
+from .services import availability, banners, catalog, distance_cache, geocode_cache, images, menus, spatial
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def recount_product_availability(sender, instance, **kwargs):
+    product_ids = {instance.product_id, getattr(instance, 'loaded_product_id', None)}
+    Product.objects.filter(id__in=product_ids - {None}).recount_availability()
+    instance.loaded_product_id = instance.product_id
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def invalidate_menu_on_menu_item_change(sender, instance, **kwargs):
+    restaurant_ids = {instance.restaurant_id, getattr(instance, 'loaded_restaurant_id', None)}
+    transaction.on_commit(lambda: menus.invalidate_menus(restaurant_ids - {None}))
+    instance.loaded_restaurant_id = instance.restaurant_id
+
+
+@receiver(post_save, sender=Product)
+def make_image_variants_on_product_save(sender, instance, raw=False, **kwargs):
+    # Fixtures are loaded before their images are in place
+    if not raw:
+        images.schedule_image_variants(instance)
+
+
+@receiver(post_delete, sender=Product)
+def delete_image_variants_on_product_delete(sender, instance, **kwargs):
+    images.schedule_variants_cleanup(instance.image_variants)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_menus_on_product_save(sender, instance, **kwargs):
+    restaurant_ids = list(instance.menu_items.values_list('restaurant_id', flat=True))
+    transaction.on_commit(lambda: menus.invalidate_menus(restaurant_ids))
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def invalidate_menus_on_category_change(sender, **kwargs):
+    # Categories change rarely, it's not worth finding the restaurants
+    transaction.on_commit(menus.invalidate_all_menus)
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_menu_on_restaurant_change(sender, instance, **kwargs):
+    restaurant_id = instance.id
+    transaction.on_commit(lambda: menus.invalidate_menus([restaurant_id]))
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def invalidate_availability_on_menu_item_change(sender, **kwargs):
+    transaction.on_commit(availability.invalidate_availability_index)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(catalog.invalidate_catalog)
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def invalidate_banners(sender, **kwargs):
+    transaction.on_commit(banners.invalidate_banners)
+
+
+@receiver(post_save, sender=Restaurant)
+def update_indexes_on_restaurant_save(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(availability.invalidate_availability_index)
+    transaction.on_commit(spatial.invalidate_spatial_index)
+    location_changed = instance.location_id != getattr(instance, 'loaded_location_id', None)
+    if instance.location and location_changed:
+        transaction.on_commit(distance_cache.forget_filled_distances)
+    instance.loaded_location_id = instance.location_id
+
+
+@receiver(post_delete, sender=Restaurant)
+def update_indexes_on_restaurant_delete(sender, instance, **kwargs):
+    transaction.on_commit(availability.invalidate_availability_index)
+    transaction.on_commit(spatial.invalidate_spatial_index)
+
+
+@receiver(post_save, sender=Location)
+def update_spatial_index_on_location_save(sender, instance, created, **kwargs):
+    if not created and instance.restaurants.exists():
+        transaction.on_commit(spatial.invalidate_spatial_index)
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def forget_cached_location(sender, instance, **kwargs):
+    address = instance.address
+    transaction.on_commit(lambda: geocode_cache.forget_address(address))
+
+
+@receiver(post_save, sender=Order)
+def record_order_save(sender, instance, **kwargs):
+    OrderChange.objects.record(
+        [instance.id],
+        removed=instance.status == 'completed',
+    )
+
+
+@receiver(post_delete, sender=Order)
+def record_order_delete(sender, instance, **kwargs):
+    OrderChange.objects.record([instance.id], removed=True)
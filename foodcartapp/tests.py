@@ -0,0 +1,795 @@
+import io
+import itertools
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+from PIL import Image
+
+from foodcartapp.models import (
+    Location, LocationDistance, Order, Product, ProductCategory, Restaurant, RestaurantMenuItem,
+)
+from foodcartapp.services import distance_cache, geocode_backfill, geolocation, images
+from foodcartapp.services.addresses import normalize_address
+from foodcartapp.services.assignment import solve_capacitated_assignment
+from foodcartapp.services.claims import OrderConflict, assign_restaurant, claim_orders
+from foodcartapp.services.gazetteer import GazetteerGeocoder
+from foodcartapp.services.spatial import RestaurantSpatialIndex
+
+
+class FakeGeocoder:
+    """Answers from a dict and remembers when it was asked.
+
+    failures makes an address fail that many times before it is answered,
+    interrupt_after stops the run like Ctrl+C after that many calls.
+    """
+
+    def __init__(self, coords_by_address, failures=None, interrupt_after=None):
+        self.coords_by_address = coords_by_address
+        self.failures = dict(failures or {})
+        self.interrupt_after = interrupt_after
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def geocode(self, address):
+        with self.lock:
+            self.calls.append((address, time.monotonic()))
+            if self.interrupt_after is not None and len(self.calls) > self.interrupt_after:
+                raise KeyboardInterrupt
+            if self.failures.get(address):
+                self.failures[address] -= 1
+                raise GeocoderUnavailable('HTTP 503')
+        return self.coords_by_address.get(address)
+
+    @property
+    def addresses(self):
+        return [address for address, _ in self.calls]
+
+
+ADDRESSES = {
+    f'Москва, ул. Садовая, {number}': (55.7 + number / 100, 37.6)
+    for number in range(1, 6)
+}
+
+
+@mock.patch.object(geocode_backfill, 'GEOCODE_RETRY_DELAY', 0)
+class GeocodeBackfillTest(TestCase):
+    def setUp(self):
+        for address in ADDRESSES:
+            Order.objects.create(
+                firstname='Иван',
+                lastname='Петров',
+                phonenumber='+79991234567',
+                address=address,
+            )
+        self.restaurant = Restaurant.objects.create(
+            name='Star Burger',
+            address='Москва, ул. Садовая, 1',
+        )
+
+    def run_backfill(self, geocoder, *args):
+        chain = geolocation.GeocoderChain([('fake', geocoder)])
+        with mock.patch.object(geolocation, 'get_geocoder', return_value=chain):
+            call_command(
+                'geocode_backfill', '--rate', '0', *args,
+                stdout=StringIO(), stderr=StringIO(),
+            )
+
+    def get_unlocated_addresses(self):
+        return set(
+            Order.objects.filter(location__isnull=True).values_list('address', flat=True)
+        )
+
+    def test_geocodes_each_address_once(self):
+        Order.objects.create(
+            firstname='Анна',
+            lastname='Сидорова',
+            phonenumber='+79991234568',
+            address='москва улица садовая 2',
+        )
+        geocoder = FakeGeocoder(ADDRESSES)
+
+        self.run_backfill(geocoder)
+
+        self.assertCountEqual(geocoder.addresses, ADDRESSES)
+        self.assertEqual(self.get_unlocated_addresses(), set())
+        self.restaurant.refresh_from_db()
+        self.assertEqual(self.restaurant.location.coords, ADDRESSES['Москва, ул. Садовая, 1'])
+
+    def test_links_known_locations_without_geocoding(self):
+        Location.objects.create(address='Москва, ул. Садовая, 3', lat=55.73, lon=37.6)
+        geocoder = FakeGeocoder(ADDRESSES)
+
+        self.run_backfill(geocoder)
+
+        self.assertNotIn('Москва, ул. Садовая, 3', geocoder.addresses)
+        self.assertEqual(self.get_unlocated_addresses(), set())
+
+    def test_keeps_to_rate_limit(self):
+        geocoder = FakeGeocoder(ADDRESSES)
+        rate = 20
+
+        self.run_backfill(geocoder, '--rate', str(rate), '--workers', '4')
+
+        call_times = sorted(called_at for _, called_at in geocoder.calls)
+        # The first call goes at once
+        min_duration = (len(call_times) - 1) / rate
+        self.assertGreaterEqual(call_times[-1] - call_times[0], min_duration * 0.9)
+
+    def test_retries_transient_errors(self):
+        geocoder = FakeGeocoder(ADDRESSES, failures={'Москва, ул. Садовая, 2': 2})
+
+        self.run_backfill(geocoder)
+
+        self.assertEqual(geocoder.addresses.count('Москва, ул. Садовая, 2'), 3)
+        self.assertEqual(self.get_unlocated_addresses(), set())
+
+    def test_leaves_failed_addresses_for_next_run(self):
+        retries = geocode_backfill.GEOCODE_RETRIES
+        failing_geocoder = FakeGeocoder(
+            ADDRESSES,
+            failures={'Москва, ул. Садовая, 2': retries + 1},
+        )
+
+        self.run_backfill(failing_geocoder)
+
+        self.assertEqual(self.get_unlocated_addresses(), {'Москва, ул. Садовая, 2'})
+        geocoder = FakeGeocoder(ADDRESSES)
+        self.run_backfill(geocoder)
+        self.assertEqual(geocoder.addresses, ['Москва, ул. Садовая, 2'])
+        self.assertEqual(self.get_unlocated_addresses(), set())
+
+    def test_resumes_after_interrupt(self):
+        interrupted_geocoder = FakeGeocoder(ADDRESSES, interrupt_after=2)
+
+        self.run_backfill(interrupted_geocoder, '--batch-size', '2', '--workers', '1')
+
+        # The first batch is saved, the interrupted one is not
+        saved_addresses = set(interrupted_geocoder.addresses[:2])
+        self.assertEqual(self.get_unlocated_addresses(), set(ADDRESSES) - saved_addresses)
+        geocoder = FakeGeocoder(ADDRESSES)
+        self.run_backfill(geocoder, '--batch-size', '2', '--workers', '1')
+        self.assertCountEqual(geocoder.addresses, set(ADDRESSES) - saved_addresses)
+        self.assertEqual(self.get_unlocated_addresses(), set())
+
+    def test_skips_recent_misses(self):
+        missing_address = 'Москва, ул. Садовая, 4'
+        coords_by_address = {
+            address: coords for address, coords in ADDRESSES.items()
+            if address != missing_address
+        }
+        self.run_backfill(FakeGeocoder(coords_by_address))
+
+        geocoder = FakeGeocoder(ADDRESSES)
+        self.run_backfill(geocoder)
+        self.assertEqual(geocoder.addresses, [])
+
+        self.run_backfill(geocoder, '--retry-missing')
+        self.assertEqual(geocoder.addresses, [missing_address])
+        self.assertEqual(self.get_unlocated_addresses(), set())
+
+
+FOUND_RESPONSE = {
+    "response": {"GeoObjectCollection": {"featureMember": [
+        {"GeoObject": {"Point": {"pos": "37.6 55.7"}}},
+    ]}},
+}
+NOT_FOUND_RESPONSE = {"response": {"GeoObjectCollection": {"featureMember": []}}}
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests_count += 1
+        status, payload, delay = server.responses.pop(0) if server.responses else (500, {}, 0)
+        if delay:
+            time.sleep(delay)
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except ConnectionError:
+            # The client has given up waiting
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GeocoderClientTest(SimpleTestCase):
+    """The Yandex client against a local server answering as told."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeocoderHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_url = f'http://127.0.0.1:{cls.server.server_port}/1.x'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.responses = []
+        self.server.requests_count = 0
+
+    def answer(self, *responses):
+        """Queue (status, payload) or (status, payload, delay) answers."""
+        self.server.responses.extend(
+            response if len(response) == 3 else (*response, 0)
+            for response in responses
+        )
+
+    def create_client(self, **kwargs):
+        kwargs.setdefault('retry_delay', 0)
+        return geolocation.GeocoderClient('key', api_url=self.api_url, **kwargs)
+
+    def test_returns_coords(self):
+        self.answer((200, FOUND_RESPONSE), (200, NOT_FOUND_RESPONSE))
+        client = self.create_client()
+
+        self.assertEqual(client.geocode('Москва'), (55.7, 37.6))
+        self.assertIsNone(client.geocode('Нигде'))
+
+    def test_retries_server_errors(self):
+        self.answer((503, {}), (502, {}), (200, FOUND_RESPONSE))
+        client = self.create_client(retries=2)
+
+        self.assertEqual(client.geocode('Москва'), (55.7, 37.6))
+        self.assertEqual(self.server.requests_count, 3)
+
+    def test_gives_up_after_retries(self):
+        self.answer((500, {}), (500, {}), (500, {}), (200, FOUND_RESPONSE))
+        client = self.create_client(retries=2)
+
+        with self.assertRaises(GeocoderUnavailable):
+            client.geocode('Москва')
+        self.assertEqual(self.server.requests_count, 3)
+
+    def test_times_out(self):
+        self.answer((200, FOUND_RESPONSE, 1))
+        client = self.create_client(timeout=(1, 0.1), retries=0)
+
+        with self.assertRaises(GeocoderTimedOut):
+            client.geocode('Москва')
+
+    def test_circuit_opens_after_failures(self):
+        self.answer((500, {}), (500, {}), (200, FOUND_RESPONSE))
+        breaker = geolocation.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        client = self.create_client(retries=0, circuit_breaker=breaker)
+
+        for _ in range(2):
+            with self.assertRaises(GeocoderUnavailable):
+                client.geocode('Москва')
+        with self.assertRaises(geolocation.GeocoderCircuitOpen):
+            client.geocode('Москва')
+        self.assertEqual(self.server.requests_count, 2)
+
+    def test_half_open_circuit_lets_one_trial_call_through(self):
+        self.answer((500, {}), (200, FOUND_RESPONSE, 0.5), (200, FOUND_RESPONSE))
+        breaker = geolocation.CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+        client = self.create_client(retries=0, circuit_breaker=breaker)
+        with self.assertRaises(GeocoderUnavailable):
+            client.geocode('Москва')
+        time.sleep(0.3)
+
+        trial_results = []
+        trial = threading.Thread(target=lambda: trial_results.append(client.geocode('Москва')))
+        trial.start()
+        time.sleep(0.1)
+        # Rejected at once while the trial call waits for the answer
+        with self.assertRaises(geolocation.GeocoderCircuitOpen):
+            client.geocode('Москва')
+        trial.join()
+
+        self.assertEqual(trial_results, [(55.7, 37.6)])
+        self.assertEqual(client.geocode('Москва'), (55.7, 37.6))
+        self.assertEqual(self.server.requests_count, 3)
+
+    def test_failed_trial_call_keeps_circuit_open(self):
+        self.answer((500, {}), (500, {}), (200, FOUND_RESPONSE))
+        breaker = geolocation.CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+        client = self.create_client(retries=0, circuit_breaker=breaker)
+        with self.assertRaises(GeocoderUnavailable):
+            client.geocode('Москва')
+        time.sleep(0.3)
+
+        with self.assertRaises(GeocoderUnavailable):
+            client.geocode('Москва')
+        with self.assertRaises(geolocation.GeocoderCircuitOpen):
+            client.geocode('Москва')
+        self.assertEqual(self.server.requests_count, 2)
+
+
+def make_image_file(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 300), color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='burger.png')
+
+
+@mock.patch.object(images, 'UNUSED_VARIANT_MIN_AGE', timedelta(0))
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_product(self, color):
+        product = Product.objects.create(name='Бургер', price=100, image=make_image_file(color))
+        images.update_image_variants(product.id, product.image.name)
+        product.refresh_from_db()
+        return product
+
+    def assert_stored(self, names, stored=True):
+        for name in names:
+            self.assertEqual(default_storage.exists(name), stored, name)
+
+    def test_makes_copies_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            product = Product.objects.create(name='Бургер', price=100, image=make_image_file('red'))
+        self.assertFalse(product.has_image_variants)
+
+        with mock.patch.object(images, '_encoder') as encoder:
+            for callback in callbacks:
+                callback()
+        encoder.submit.assert_called_once_with(
+            images.run_in_background, images.update_image_variants, product.id, product.image.name,
+        )
+
+    def test_replaced_image_copies_are_deleted(self):
+        product = self.create_product('red')
+        previous_names = images.get_variant_names(product.image_variants)
+        self.assert_stored(previous_names)
+
+        product.image = make_image_file('blue')
+        product.save()
+        images.update_image_variants(product.id, product.image.name)
+
+        product.refresh_from_db()
+        self.assertTrue(product.has_image_variants)
+        self.assert_stored(images.get_variant_names(product.image_variants))
+        self.assert_stored(previous_names, stored=False)
+
+    def test_shared_copies_are_kept(self):
+        product = self.create_product('red')
+        twin_product = self.create_product('red')
+        names = images.get_variant_names(product.image_variants)
+        self.assertEqual(images.get_variant_names(twin_product.image_variants), names)
+
+        product.delete()
+        images.delete_unused_variants(names)
+
+        self.assert_stored(names)
+
+    def test_recent_copies_are_kept(self):
+        product = self.create_product('red')
+        names = images.get_variant_names(product.image_variants)
+        Product.objects.filter(id=product.id).update(image_variants={})
+
+        with mock.patch.object(images, 'UNUSED_VARIANT_MIN_AGE', timedelta(hours=1)):
+            self.assertEqual(images.delete_all_unused_variants(), 0)
+        self.assert_stored(names)
+        self.assertEqual(images.delete_all_unused_variants(), len(names))
+        self.assert_stored(names, stored=False)
+
+
+class GazetteerGeocoderTest(SimpleTestCase):
+    def setUp(self):
+        self.geocoder = GazetteerGeocoder([
+            ('Москва, ул. Новый Арбат, 15', 55.752, 37.587),
+            ('Москва, ул. Садовая-Кудринская, 5', 55.761, 37.585),
+            ('Москва, ул. Тверская, 7', 55.759, 37.612),
+            ('Москва, Новинский бульвар, 8', 55.750, 37.582),
+        ])
+
+    def test_finds_exact_address(self):
+        self.assertEqual(self.geocoder.geocode('г. Москва, улица Новый Арбат, д. 15'), (55.752, 37.587))
+
+    def test_finds_address_with_typos(self):
+        self.assertEqual(self.geocoder.geocode('Москва, ул. Тверскя, 7'), (55.759, 37.612))
+        self.assertEqual(self.geocoder.geocode('Масква, Новинскй бульвар, 8'), (55.750, 37.582))
+
+    def test_keeps_house_number(self):
+        self.assertIsNone(self.geocoder.geocode('Москва, ул. Тверская, 8'))
+
+    def test_skips_other_street_with_same_number(self):
+        self.assertIsNone(self.geocoder.geocode('Москва, ул. Старый Арбат, 15'))
+        self.assertIsNone(self.geocoder.geocode('Москва, Старый Арбат, 15'))
+        self.assertIsNone(self.geocoder.geocode('Москва, ул. Садовая, 5'))
+
+
+class DistanceCacheTest(TestCase):
+    def setUp(self):
+        self.order_location = Location.objects.create(address='Москва, ул. Тверская, 7', lat=55.759, lon=37.612)
+        self.order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79991234567',
+            address=self.order_location.address,
+            location=self.order_location,
+        )
+        self.restaurant = self.create_restaurant('Москва, ул. Тверская, 1', 55.757, 37.613)
+
+    def create_restaurant(self, address, lat, lon):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Restaurant.objects.create(
+                name='Star Burger',
+                address=address,
+                location=Location.objects.create(address=address, lat=lat, lon=lon),
+            )
+
+    def get_order_distances(self):
+        order = Order.objects.select_related('location').get(id=self.order.id)
+        restaurants = Restaurant.objects.select_related('location')
+        return distance_cache.get_order_distances([order], restaurants)
+
+    def test_order_page_computes_distances_without_storing_them(self):
+        distances = self.get_order_distances()
+
+        self.assertIn((self.order_location.id, self.restaurant.location_id), distances)
+        self.assertFalse(LocationDistance.objects.exists())
+        self.order_location.refresh_from_db()
+        self.assertFalse(self.order_location.distances_filled)
+
+    def test_worker_fills_open_orders_distances(self):
+        self.assertEqual(distance_cache.fill_pending_distances(), 1)
+
+        self.assertTrue(LocationDistance.objects.filter(
+            origin=self.order_location,
+            destination=self.restaurant.location,
+        ).exists())
+        self.assertEqual(distance_cache.fill_pending_distances(), 0)
+
+    def test_new_restaurant_refills_filled_locations(self):
+        distance_cache.fill_pending_distances()
+
+        new_restaurant = self.create_restaurant('Москва, ул. Тверская, 12', 55.764, 37.606)
+
+        self.order_location.refresh_from_db()
+        self.assertFalse(self.order_location.distances_filled)
+        distance_cache.fill_pending_distances()
+        self.assertTrue(LocationDistance.objects.filter(
+            origin=self.order_location,
+            destination=new_restaurant.location,
+        ).exists())
+
+
+class RestaurantSpatialIndexTest(SimpleTestCase):
+    """The grid index against distances to every restaurant."""
+
+    def setUp(self):
+        randomizer = random.Random(1)
+        points = [
+            (restaurant_id, (55.75 + randomizer.uniform(-0.4, 0.4), 37.62 + randomizer.uniform(-0.6, 0.6)))
+            for restaurant_id in range(1, 201)
+        ]
+        # A few far away, in Saint Petersburg
+        points += [
+            (restaurant_id, (59.94 + randomizer.uniform(-0.1, 0.1), 30.31 + randomizer.uniform(-0.1, 0.1)))
+            for restaurant_id in range(201, 206)
+        ]
+        self.index = RestaurantSpatialIndex(points)
+        self.queries = [
+            (55.75 + randomizer.uniform(-0.5, 0.5), 37.62 + randomizer.uniform(-0.7, 0.7))
+            for _ in range(30)
+        ]
+
+    def get_all_distances(self, point, allowed_ids=None):
+        restaurant_ids = [
+            restaurant_id for restaurant_id in self.index.points
+            if allowed_ids is None or restaurant_id in allowed_ids
+        ]
+        distances = self.index.get_distances([(point, restaurant_id) for restaurant_id in restaurant_ids])
+        return sorted(zip(restaurant_ids, distances), key=lambda pair: pair[1])
+
+    def assert_same_restaurants(self, nearby, expected_nearby):
+        self.assertEqual(
+            [restaurant_id for restaurant_id, _ in nearby],
+            [restaurant_id for restaurant_id, _ in expected_nearby],
+        )
+        for (_, km), (_, expected_km) in zip(nearby, expected_nearby):
+            self.assertAlmostEqual(km, expected_km, places=6)
+
+    def test_nearest(self):
+        for point in self.queries:
+            with self.subTest(point=point):
+                self.assert_same_restaurants(self.index.nearest(point, k=5), self.get_all_distances(point)[:5])
+
+    def test_nearest_among_allowed(self):
+        allowed_ids = set(range(1, 206, 7))
+        for point in self.queries:
+            with self.subTest(point=point):
+                self.assert_same_restaurants(
+                    self.index.nearest(point, k=3, allowed_ids=allowed_ids),
+                    self.get_all_distances(point, allowed_ids)[:3],
+                )
+
+    def test_within_radius(self):
+        for point in self.queries:
+            with self.subTest(point=point):
+                self.assert_same_restaurants(
+                    self.index.within(point, 7),
+                    [(restaurant_id, km) for restaurant_id, km in self.get_all_distances(point) if km <= 7],
+                )
+
+    def test_nearest_far_from_everything(self):
+        point = (43.59, 39.72)
+
+        self.assert_same_restaurants(self.index.nearest(point, k=2), self.get_all_distances(point)[:2])
+        self.assertEqual(self.index.within(point, 50), [])
+
+
+class CapacitatedAssignmentTest(SimpleTestCase):
+    def create_case(self, randomizer, orders_count, restaurants_count):
+        costs = np.array([
+            [
+                np.inf if randomizer.random() < 0.25 else round(randomizer.uniform(0.5, 20), 2)
+                for _ in range(restaurants_count)
+            ]
+            for _ in range(orders_count)
+        ])
+        capacities = [randomizer.randint(0, 2) for _ in range(restaurants_count)]
+        return costs, capacities
+
+    def get_feasible_assignments(self, costs, capacities):
+        orders_count, restaurants_count = costs.shape
+        for assignment in itertools.product(range(-1, restaurants_count), repeat=orders_count):
+            loads = [assignment.count(column) for column in range(restaurants_count)]
+            if any(load > capacity for load, capacity in zip(loads, capacities)):
+                continue
+            if all(column == -1 or np.isfinite(costs[row, column]) for row, column in enumerate(assignment)):
+                yield assignment
+
+    def solve_by_brute_force(self, costs, capacities):
+        """Rows assigned in order while some assignment still fits them all, then the cheapest one."""
+        assignments = [
+            (frozenset(row for row, column in enumerate(assignment) if column != -1), assignment)
+            for assignment in self.get_feasible_assignments(costs, capacities)
+        ]
+        assigned_rows = set()
+        for row in range(len(costs)):
+            if any(assigned_rows | {row} <= rows for rows, _ in assignments):
+                assigned_rows.add(row)
+        return assigned_rows, min(
+            self.get_total_cost(costs, assignment)
+            for rows, assignment in assignments
+            if rows == assigned_rows
+        )
+
+    def get_total_cost(self, costs, assignment):
+        return sum(costs[row, column] for row, column in enumerate(assignment) if column != -1)
+
+    def test_matches_brute_force(self):
+        randomizer = random.Random(1)
+        for case_number in range(40):
+            costs, capacities = self.create_case(randomizer, randomizer.randint(1, 6), randomizer.randint(1, 3))
+            with self.subTest(case_number=case_number, costs=costs.tolist(), capacities=capacities):
+                assignment = solve_capacitated_assignment(costs, capacities)
+                expected_rows, expected_cost = self.solve_by_brute_force(costs, capacities)
+
+                self.assertIn(tuple(assignment), set(self.get_feasible_assignments(costs, capacities)))
+                self.assertEqual({row for row, column in enumerate(assignment) if column != -1}, expected_rows)
+                self.assertAlmostEqual(self.get_total_cost(costs, assignment), expected_cost)
+
+    def test_earlier_orders_keep_the_last_place(self):
+        costs = np.array([[5.0, np.inf], [1.0, np.inf]])
+
+        assignment = solve_capacitated_assignment(costs, [1, 1])
+
+        self.assertEqual(list(assignment), [0, -1])
+
+
+class OrderClaimsTest(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user('manager', is_staff=True)
+        self.other_manager = User.objects.create_user('other_manager', is_staff=True)
+        self.restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, ул. Тверская, 7')
+        self.orders = [
+            Order.objects.create(
+                firstname='Иван',
+                lastname='Петров',
+                phonenumber='+79991234567',
+                address=f'Москва, ул. Садовая, {number}',
+            )
+            for number in range(1, 5)
+        ]
+
+    def test_managers_claim_different_orders(self):
+        order_ids = claim_orders(self.manager, 2)
+        other_order_ids = claim_orders(self.other_manager, 10)
+
+        self.assertEqual(order_ids, [order.id for order in self.orders[:2]])
+        self.assertEqual(other_order_ids, [order.id for order in self.orders[2:]])
+
+    def test_expired_claim_can_be_taken(self):
+        claim_orders(self.manager, 10)
+        Order.objects.filter(id=self.orders[0].id).update(claimed_at=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(claim_orders(self.other_manager, 10), [self.orders[0].id])
+
+    def test_assigns_restaurant_at_current_version(self):
+        order = self.orders[0]
+
+        version = assign_restaurant(order.id, self.restaurant.id, order.version, self.manager)
+
+        order.refresh_from_db()
+        self.assertEqual(order.version, version)
+        self.assertEqual(order.restaurant, self.restaurant)
+        self.assertEqual(order.status, 'in_progress')
+        self.assertEqual(order.manager, self.manager)
+
+    def test_stale_version_is_rejected(self):
+        order = self.orders[0]
+        seen_version = order.version
+        order.comment = 'Позвонить за час'
+        order.save()
+
+        with self.assertRaises(OrderConflict):
+            assign_restaurant(order.id, self.restaurant.id, seen_version, self.manager)
+        order.refresh_from_db()
+        self.assertIsNone(order.restaurant)
+        self.assertEqual(order.status, 'raw')
+
+    def test_order_claimed_by_other_manager_is_rejected(self):
+        claim_orders(self.other_manager, 1)
+        order = Order.objects.get(id=self.orders[0].id)
+
+        with self.assertRaises(OrderConflict):
+            assign_restaurant(order.id, self.restaurant.id, order.version, self.manager)
+        order.refresh_from_db()
+        self.assertIsNone(order.restaurant)
+
+
+class NormalizeAddressTest(SimpleTestCase):
+    def test_examples(self):
+        examples = {
+            'г. Москва, ул. Новый Арбат, д. 15': 'москва улица новый арбат 15',
+            'москва улица новый арбат 15': 'москва улица новый арбат 15',
+            '  МОСКВА,ул.Новый   Арбат,15 ': 'москва улица новый арбат 15',
+            'Москва, пр-т Мира, 15/2, корп. 1': 'москва проспект мира 15/2 корпус 1',
+            'Москва, просп. Мира, 15/2 к 1': 'москва проспект мира 15/2 корпус 1',
+            'Москва, Вёшняковская ул., 3': 'москва вешняковская улица 3',
+            'Москва, ТЦ «Европейский» - 2 этаж': 'москва тц европейский 2 этаж',
+            # Could be проезд as well
+            'Москва, пр. Серебрякова, 2': 'москва пр серебрякова 2',
+        }
+        for address, address_key in examples.items():
+            with self.subTest(address=address):
+                self.assertEqual(normalize_address(address), address_key)
+
+
+class MergeDuplicateLocationsMigrationTest(TransactionTestCase):
+    migrate_from = [('foodcartapp', '0061_location_address_key')]
+    migrate_to = [('foodcartapp', '0062_merge_duplicate_locations')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        return executor.loader.project_state(self.migrate_to).apps
+
+    def test_merges_locations_into_geocoded_one(self):
+        Location = self.apps.get_model('foodcartapp', 'Location')
+        LocationDistance = self.apps.get_model('foodcartapp', 'LocationDistance')
+        Order = self.apps.get_model('foodcartapp', 'Order')
+        Restaurant = self.apps.get_model('foodcartapp', 'Restaurant')
+        duplicate = Location.objects.create(address='москва улица новый арбат 15')
+        kept = Location.objects.create(address='г. Москва, ул. Новый Арбат, д. 15', lat=55.75, lon=37.59)
+        other = Location.objects.create(address='Москва, ул. Тверская, 7', lat=55.76, lon=37.61)
+        far = Location.objects.create(address='Москва, ул. Садовая, 1', lat=55.77, lon=37.63)
+        order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79991234567',
+            address=duplicate.address,
+            location=duplicate,
+        )
+        restaurant = Restaurant.objects.create(name='Star Burger', address=duplicate.address, location=duplicate)
+        LocationDistance.objects.create(origin=kept, destination=other, km=1.5)
+        LocationDistance.objects.create(origin=duplicate, destination=other, km=1.5)
+        LocationDistance.objects.create(origin=far, destination=duplicate, km=3)
+
+        apps = self.migrate()
+
+        Location = apps.get_model('foodcartapp', 'Location')
+        LocationDistance = apps.get_model('foodcartapp', 'LocationDistance')
+        self.assertEqual(
+            dict(Location.objects.values_list('id', 'address_key')),
+            {
+                kept.id: 'москва улица новый арбат 15',
+                other.id: 'москва улица тверская 7',
+                far.id: 'москва улица садовая 1',
+            },
+        )
+        self.assertEqual(apps.get_model('foodcartapp', 'Order').objects.get(id=order.id).location_id, kept.id)
+        self.assertEqual(apps.get_model('foodcartapp', 'Restaurant').objects.get(id=restaurant.id).location_id, kept.id)
+        self.assertCountEqual(
+            LocationDistance.objects.values_list('origin_id', 'destination_id'),
+            [(kept.id, other.id), (far.id, kept.id)],
+        )
+
+
+class ProductListApiTest(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            category = ProductCategory.objects.create(name='Бургеры')
+            restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, ул. Тверская, 7')
+            self.products = [
+                Product.objects.create(name=name, category=category, price=price, image='burger.png')
+                for name, price in [('Чизбургер', 150), ('Гамбургер', 120)]
+            ]
+            for product in self.products:
+                RestaurantMenuItem.objects.create(restaurant=restaurant, product=product, availability=True)
+
+    def test_conditional_get_returns_304(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        etag = response['ETag']
+
+        for if_none_match in [etag, f'W/{etag}', f'"other", {etag}']:
+            with self.subTest(if_none_match=if_none_match):
+                response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=if_none_match)
+
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(response['ETag'], etag)
+
+    def test_changed_catalog_is_sent_again(self):
+        etag = self.client.get('/api/products/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].price = 160
+            self.products[0].save()
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_only_asked_fields_are_sent(self):
+        response = self.client.get('/api/products/', {'fields': 'id,name', 'limit': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'products': [{'id': self.products[0].id, 'name': 'Чизбургер'}],
+            'next': self.products[0].id,
+        })
+
+    def test_unknown_field_gets_400(self):
+        response = self.client.get('/api/products/', {'fields': 'id,bogus'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.json()['error'])
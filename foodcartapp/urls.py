@@ -1,12 +1,20 @@
 from django.urls import path, include
 
-from .views import product_list_api, banners_list_api, register_order
+from .views import (
+    banners_list_api,
+    menus_list_api,
+    product_list_api,
+    register_order,
+    restaurant_menu_api,
+)
 
 
 app_name = "foodcartapp"
 
 urlpatterns = [
     path('products/', product_list_api),
+    path('restaurants/<int:restaurant_id>/menu/', restaurant_menu_api),
+    path('menus/', menus_list_api),
     path('banners/', banners_list_api),
     path('order/', register_order),
 ]
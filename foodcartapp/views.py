@@ -1,75 +1,103 @@
+from django import forms
 from django.db import transaction
-from django.http import JsonResponse
-from django.templatetags.static import static
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from .models import Order, OrderItem, Product
+from .models import Order, OrderItem
+from .renderers import FastJSONResponse
 from .serializers import OrderSerializer
+from .services.banners import get_banners
+from .services.catalog import (
+    PRODUCT_FIELD_COLUMNS,
+    PRODUCTS_MAX_PAGE_SIZE,
+    PRODUCTS_PAGE_SIZE,
+    get_catalog,
+    get_products_page,
+)
+from .services.menus import get_all_menus, get_menu
+
+
+def is_not_modified(request, etag):
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    # If-None-Match compares the tags weakly
+    return "*" in etags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in etags]
+
+
+def get_payload_response(request, payload):
+    """The payload in the best encoding the client accepts, 304 if it has it."""
+    encoding, content, etag = payload.get_variant(request.headers.get("Accept-Encoding", ""))
+    if is_not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type="application/json")
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    # Cached, but checked for changes on every use
+    response["Cache-Control"] = "no-cache"
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
 
 
 def banners_list_api(request):
-    # FIXME move data to db?
-    return JsonResponse(
-        [
-            {
-                "title": "Burger",
-                "src": static("burger.jpg"),
-                "text": "Tasty Burger at your door step",
-            },
-            {
-                "title": "Spices",
-                "src": static("food.jpg"),
-                "text": "All Cuisines",
-            },
-            {
-                "title": "New York",
-                "src": static("tasty.jpg"),
-                "text": "Food is incomplete without a tasty dessert",
-            },
-        ],
-        safe=False,
-        json_dumps_params={
-            "ensure_ascii": False,
-            "indent": 4,
-        },
+    return get_payload_response(request, get_banners())
+
+
+class ProductListForm(forms.Form):
+    fields = forms.CharField(required=False)
+    after = forms.IntegerField(min_value=0, required=False)
+    limit = forms.IntegerField(
+        min_value=1,
+        max_value=PRODUCTS_MAX_PAGE_SIZE,
+        required=False,
     )
 
+    def clean_fields(self):
+        if not self.cleaned_data["fields"]:
+            return list(PRODUCT_FIELD_COLUMNS)
+        fields = list(dict.fromkeys(
+            field.strip() for field in self.cleaned_data["fields"].split(",") if field.strip()
+        ))
+        unknown_fields = [field for field in fields if field not in PRODUCT_FIELD_COLUMNS]
+        if unknown_fields:
+            raise forms.ValidationError(
+                f"Неизвестные поля: {', '.join(unknown_fields)}. "
+                f"Доступны: {', '.join(PRODUCT_FIELD_COLUMNS)}",
+                code="invalid",
+            )
+        return fields
+
 
 def product_list_api(request):
-    products = Product.objects.select_related("category").available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            "id": product.id,
-            "name": product.name,
-            "price": product.price,
-            "special_status": product.special_status,
-            "description": product.description,
-            "category": {
-                "id": product.category.id,
-                "name": product.category.name,
-            }
-            if product.category
-            else None,
-            "image": product.image.url,
-            "restaurant": {
-                "id": product.id,
-                "name": product.name,
-            },
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(
-        dumped_products,
-        safe=False,
-        json_dumps_params={
-            "ensure_ascii": False,
-            "indent": 4,
-        },
+    """The whole cached catalog, or a page of it with ?fields=, ?after= or ?limit=."""
+    if not any(param in request.GET for param in ProductListForm.base_fields):
+        return get_payload_response(request, get_catalog())
+
+    form = ProductListForm(request.GET)
+    if not form.is_valid():
+        return FastJSONResponse({"error": form.errors.get_json_data()}, status=400)
+    products, next_cursor = get_products_page(
+        form.cleaned_data["fields"],
+        after=form.cleaned_data["after"],
+        limit=form.cleaned_data["limit"] or PRODUCTS_PAGE_SIZE,
     )
+    return FastJSONResponse({"products": products, "next": next_cursor})
+
+
+def restaurant_menu_api(request, restaurant_id):
+    menu = get_menu(restaurant_id)
+    if menu is None:
+        raise Http404
+    return get_payload_response(request, menu)
+
+
+def menus_list_api(request):
+    return get_payload_response(request, get_all_menus())
 
 
 @transaction.atomic
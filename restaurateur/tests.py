@@ -1,3 +1,104 @@
+from django.contrib.auth.models import User
+from django.template.loader import render_to_string
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from foodcartapp.models import Order, OrderChange, Restaurant
+
+
+class OrderChangesApiTest(TestCase):
+    def setUp(self):
+        manager = User.objects.create_user('manager', password='secret', is_staff=True)
+        self.client.force_login(manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders = [
+                Order.objects.create(
+                    firstname='Иван',
+                    lastname='Петров',
+                    phonenumber='+79991234567',
+                    address=f'Москва, ул. Садовая, {number}',
+                )
+                for number in range(1, 4)
+            ]
+        self.change_ids = list(OrderChange.objects.order_by('id').values_list('id', flat=True))
+
+    def get_changes(self, **params):
+        response = self.client.get(reverse('restaurateur:order_changes'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_returns_changes_since_cursor(self):
+        changes = self.get_changes(since=self.change_ids[0])
+
+        self.assertFalse(changes['reset'])
+        self.assertEqual(changes['cursor'], self.change_ids[-1])
+        # Changes of the last seconds are read again in case of late commits
+        self.assertLessEqual(
+            {order.id for order in self.orders[1:]},
+            {order['id'] for order in changes['orders']},
+        )
+
+    def test_pruned_cursor_starts_over_from_latest_change(self):
+        OrderChange.objects.filter(id__lt=self.change_ids[-1]).delete()
+        stale_cursor = self.change_ids[0] - 1
+
+        changes = self.get_changes(since=stale_cursor, after=f'1.{self.orders[1].id}')
+
+        self.assertTrue(changes['reset'])
+        self.assertEqual(changes['cursor'], self.change_ids[-1])
+        # The first page, not the one after the order the client stopped at
+        self.assertCountEqual(
+            [order['id'] for order in changes['orders']],
+            [order.id for order in self.orders],
+        )
+
+    def test_anonymous_client_gets_401(self):
+        self.client.logout()
+
+        response = self.client.get(reverse('restaurateur:order_changes'))
+
+        self.assertEqual(response.status_code, 401)
+
+
+class AssignRestaurantApiTest(TestCase):
+    def test_stale_version_gets_409_with_current_order(self):
+        manager = User.objects.create_user('manager', password='secret', is_staff=True)
+        self.client.force_login(manager)
+        restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, ул. Тверская, 7')
+        order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79991234567',
+            address='Москва, ул. Садовая, 1',
+        )
+        seen_version = order.version
+        order.save()
+
+        response = self.client.post(
+            reverse('restaurateur:assign_restaurant', args=[order.id]),
+            {'restaurant': restaurant.id, 'version': seen_version},
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['orders'][0]['version'], seen_version + 1)
+        order.refresh_from_db()
+        self.assertIsNone(order.restaurant)
+
+
+class OrderRowTest(TestCase):
+    def test_shows_zero_distance_to_assigned_restaurant(self):
+        restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, ул. Тверская, 7')
+        order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79991234567',
+            address=restaurant.address,
+            restaurant=restaurant,
+        )
+
+        row = render_to_string('order_row.html', {'info': {
+            'order': order,
+            'assigned_restaurant_info': (restaurant, 0.0),
+        }})
+
+        self.assertIn('Готовит Star Burger – 0.00 км', row)
@@ -14,6 +14,13 @@ urlpatterns = [
 
     # TODO заглушка для нереализованного функционала
     path('orders/', views.view_orders, name="view_orders"),
+    path('orders/stream/', views.stream_orders, name="stream_orders"),
+    path('orders/changes/', views.order_changes_api, name="order_changes"),
+    path('orders/claim/', views.claim_orders_api, name="claim_orders"),
+    path('orders/release/', views.release_orders_api, name="release_orders"),
+    path('orders/<int:order_id>/assign/', views.assign_restaurant_api, name="assign_restaurant"),
+
+    path('geocoding/metrics/', views.geocoding_metrics_api, name="geocoding_metrics"),
 
     path('login/', views.LoginView.as_view(), name="login"),
     path('logout/', views.LogoutView.as_view(), name="logout"),
@@ -1,14 +1,19 @@
 from collections import defaultdict
+from functools import wraps
+
 from django import forms
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import user_passes_test
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import redirect, render
-from django.urls import reverse_lazy
+from django.template.loader import render_to_string
+from django.urls import reverse, reverse_lazy
 from django.views import View
+from django.views.decorators.http import require_POST
 from django.db.models import Prefetch
 from django.conf import settings
-from foodcartapp.models import Order, Product, Restaurant, RestaurantMenuItem, Location
+from foodcartapp.models import Order, OrderChange, Product, Restaurant, RestaurantMenuItem, Location
 from django.conf import settings
 from collections import defaultdict
 from django.shortcuts import render
@@ -16,14 +21,24 @@ from django.contrib.auth.decorators import user_passes_test
 from django.db.models import Case, When, IntegerField
 import requests
 import logging
+import json
+import time
+from datetime import datetime, timedelta
+
+from django.utils import timezone
 
 from foodcartapp.models import Order
-from foodcartapp.services.geolocation import (
-    get_or_update_coordinates,
+from foodcartapp.renderers import FastJSONResponse, dumps
+from foodcartapp.services.availability import get_availability_index
+from foodcartapp.services.claims import (
+    OrderConflict, assign_restaurant, claim_orders, release_orders,
 )
+from foodcartapp.services.distance_cache import get_order_distances
+from foodcartapp.services.geocode_metrics import get_metrics
+from foodcartapp.services.geocoding_queue import get_pending_addresses
+from foodcartapp.services.spatial import get_spatial_index
 
 from geopy.geocoders import Yandex
-from geopy.distance import distance
 from geopy.exc import GeocoderServiceError
 
 
@@ -91,6 +106,18 @@ def is_manager(user):
     return user.is_staff  # FIXME replace with specific permission
 
 
+def manager_api(view):
+    """Like user_passes_test(is_manager), but answers API clients with 401 or 403."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return FastJSONResponse({"error": "Нужно войти как менеджер"}, status=401)
+        if not is_manager(request.user):
+            return FastJSONResponse({"error": "Доступно только менеджерам"}, status=403)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
 @user_passes_test(is_manager, login_url="restaurateur:login")
 def view_products(request):
     restaurants = list(Restaurant.objects.order_by("name"))
@@ -129,77 +156,170 @@ def view_restaurants(request):
     )
 
 
-@user_passes_test(is_manager, login_url="restaurateur:login")
-def view_orders(request):
-    orders = (
-        Order.objects.with_total_price()
-        .exclude(status="completed")
-        .annotate(
-            is_raw=Case(
-                When(status="raw", then=1),
-                default=0,
-                output_field=IntegerField()
-            )
-        )
-        .select_related("restaurant", "location")
-        .prefetch_related("items__product")
-        .order_by("-is_raw", "-id")
+ORDERS_PAGE_SIZE = 50
+ORDER_STREAM_DURATION = 55
+ORDER_STREAM_POLL_INTERVAL = 0.5
+ORDER_STREAM_KEEPALIVE_INTERVAL = 15
+ORDER_STREAM_BATCH_SIZE = 100
+ORDER_CHANGES_BATCH_SIZE = 500
+ORDER_CLAIM_MAX_BATCH_SIZE = 100
+# Changes are logged right after their transactions commit, yet one that
+# took a lower id may still become visible after a higher one was read.
+# Changes that recent are read once more so that none is skipped.
+ORDER_CHANGES_REREAD_WINDOW = timedelta(seconds=10)
+
+
+class OrderFilters(forms.Form):
+    status = forms.ChoiceField(
+        label="Статус",
+        choices=[("", "Все")] + [
+            (status, title) for status, title in Order.ORDER_STATUS
+            if status != "completed"
+        ],
+        required=False,
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+    payment_method = forms.ChoiceField(
+        label="Способ оплаты",
+        choices=[("", "Все")] + Order.PAYMENT_METHOD,
+        required=False,
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+    restaurant = forms.ModelChoiceField(
+        label="Ресторан",
+        queryset=Restaurant.objects.order_by("name"),
+        required=False,
+        empty_label="Все",
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+    registered_from = forms.DateField(
+        label="Создан с",
+        required=False,
+        widget=forms.DateInput(attrs={"class": "form-control", "type": "date"}),
+    )
+    registered_to = forms.DateField(
+        label="по",
+        required=False,
+        widget=forms.DateInput(attrs={"class": "form-control", "type": "date"}),
+    )
+    after = forms.RegexField(
+        label="Страница",
+        regex=r"^[01]\.\d+$",
+        required=False,
+        widget=forms.HiddenInput,
     )
 
+    def filter_orders(self, orders):
+        """Apply the filters that are valid, the invalid ones are left out."""
+        filters = self.cleaned_data
+        if filters.get("status"):
+            orders = orders.filter(status=filters["status"])
+        if filters.get("payment_method"):
+            orders = orders.filter(payment_method=filters["payment_method"])
+        if filters.get("restaurant"):
+            orders = orders.filter(restaurant=filters["restaurant"])
+        # Bounds of days rather than __date, which the index can't serve
+        if filters.get("registered_from"):
+            orders = orders.filter(registered_at__gte=get_start_of_day(filters["registered_from"]))
+        if filters.get("registered_to"):
+            orders = orders.filter(
+                registered_at__lt=get_start_of_day(filters["registered_to"] + timedelta(days=1)),
+            )
+        return orders
+
+
+def get_start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def get_orders_page(orders, cursor=None, page_size=ORDERS_PAGE_SIZE):
+    """One page of orders by (-is_raw, -id) and the cursor of the next one.
+
+    The cursor is "<is_raw>.<id>" of the last order on the previous page.
+    Raw and processed orders are read as two id-ordered segments, so every
+    page is a couple of index range scans no matter how deep it is.
+    """
+    segments = [
+        (1, orders.filter(status="raw")),
+        (0, orders.exclude(status="raw")),
+    ]
+    page = []
+    for is_raw, segment in segments:
+        if cursor:
+            cursor_is_raw, cursor_id = map(int, cursor.split("."))
+            if is_raw > cursor_is_raw:
+                continue
+            if is_raw == cursor_is_raw:
+                segment = segment.filter(id__lt=cursor_id)
+        segment_orders = list(segment.order_by("-id")[:page_size + 1 - len(page)])
+        for order in segment_orders:
+            order.is_raw = is_raw
+        page.extend(segment_orders)
+        if len(page) > page_size:
+            break
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = f"{page[-1].is_raw}.{page[-1].id}"
+    return page, next_cursor
+
+
+def get_order_infos(orders):
     restaurants = list(
-        Restaurant.objects
-        .select_related("location")
-        .order_by("name")
+        Restaurant.objects.select_related("location").order_by("name")
     )
-
-    menu_items = RestaurantMenuItem.objects.filter(availability=True).select_related(
-        "restaurant", "product"
+    restaurants_by_id = {restaurant.id: restaurant for restaurant in restaurants}
+    availability_index = get_availability_index()
+    distances = get_order_distances(orders, restaurants)
+    max_km = settings.DELIVERY_RADIUS_KM
+
+    unknown_assigned_orders = [
+        order for order in orders
+        if order.restaurant and order.location and order.location.coords
+        and (order.location_id, order.restaurant.location_id) not in distances
+    ]
+    if unknown_assigned_orders:
+        # Assigned restaurants may lie outside of the delivery radius
+        spatial_index = get_spatial_index()
+        assigned_distances = spatial_index.get_distances([
+            (order.location.coords, order.restaurant_id)
+            for order in unknown_assigned_orders
+        ])
+        for order, dist in zip(unknown_assigned_orders, assigned_distances):
+            if dist is not None:
+                distances[order.location_id, order.restaurant.location_id] = dist
+
+    pending_addresses = get_pending_addresses(
+        {order.address for order in orders if not order.location_id}
     )
 
-    available_in = defaultdict(set)
-    for item in menu_items:
-        available_in[item.product_id].add(item.restaurant_id)
-
-    restaurant_coords = {}
-    for restaurant in restaurants:
-        location = restaurant.location
-        if location and location.lat and location.lon:
-            restaurant_coords[restaurant.id] = (location.lat, location.lon)
-        else:
-            restaurant_coords[restaurant.id] = None
-
-    order_coords = {}
-    for order in orders:
-        location = order.location
-        if location and location.lat and location.lon:
-            order_coords[order.id] = (location.lat, location.lon)
-        else:
-            order_coords[order.id] = None
-
     order_infos = []
     for order in orders:
-        products = [item.product for item in order.items.all()]
-        order_point = order_coords.get(order.id)
-        geocode_error = order_point is None
+        geocode_pending = not order.location_id and order.address in pending_addresses
+        geocode_error = not (order.location and order.location.coords)
 
         suitable_restaurants = []
-        if order_point:
-            for restaurant in restaurants:
-                if all(restaurant.id in available_in[product.id] for product in products):
-                    rest_point = restaurant_coords.get(restaurant.id)
-                    if rest_point:
-                        dist = distance(order_point, rest_point).km
-                        suitable_restaurants.append(
-                            (restaurant, round(dist, 2)))
-
+        if not geocode_error:
+            eligible_ids = availability_index.get_eligible_restaurant_ids(
+                [item.product_id for item in order.items.all()]
+            )
+            for restaurant_id in eligible_ids:
+                restaurant = restaurants_by_id.get(restaurant_id)
+                if not restaurant:
+                    continue
+                dist = distances.get((order.location_id, restaurant.location_id))
+                if dist is None or (max_km is not None and dist > max_km):
+                    continue
+                suitable_restaurants.append((restaurant, round(dist, 2)))
             suitable_restaurants.sort(key=lambda r: r[1])
+            suitable_restaurants = suitable_restaurants[:settings.ORDER_RESTAURANTS_LIMIT]
 
         assigned_info = None
         if order.restaurant:
-            rest_point = restaurant_coords.get(order.restaurant.id)
-            if order_point and rest_point:
-                assigned_info = (order.restaurant, round(
-                    distance(order_point, rest_point).km, 2))
+            dist = distances.get((order.location_id, order.restaurant.location_id))
+            if dist is not None:
+                assigned_info = (order.restaurant, round(dist, 2))
             else:
                 assigned_info = (order.restaurant, None)
 
@@ -207,7 +327,399 @@ def view_orders(request):
             "order": order,
             "available_restaurants": suitable_restaurants,
             "assigned_restaurant_info": assigned_info,
-            "geocode_error": geocode_error,
+            "geocode_error": geocode_error and not geocode_pending,
+            "geocode_pending": geocode_pending,
         })
+    return order_infos
+
+
+def get_open_orders():
+    return (
+        Order.objects.with_total_price()
+        .exclude(status="completed")
+        .select_related("restaurant__location", "location", "manager")
+        .prefetch_related("items")
+    )
+
+
+def get_last_order_change_id():
+    return (
+        OrderChange.objects.order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    ) or 0
+
+
+@user_passes_test(is_manager, login_url="restaurateur:login")
+def view_orders(request):
+    filters = OrderFilters(request.GET)
+    # The errors are shown above the orders filtered by the valid fields
+    filters.is_valid()
+
+    # Taken before the orders, the changes committed later come in the stream
+    last_change_id = get_last_order_change_id()
+    orders, next_cursor = get_orders_page(
+        filters.filter_orders(get_open_orders()),
+        cursor=filters.cleaned_data.get("after"),
+    )
+
+    next_page_url = None
+    if next_cursor:
+        query = request.GET.copy()
+        query["after"] = next_cursor
+        next_page_url = f"?{query.urlencode()}"
+
+    first_page_url = None
+    if filters.cleaned_data.get("after"):
+        query = request.GET.copy()
+        query.pop("after")
+        first_page_url = f"?{query.urlencode()}"
+
+    stream_query = request.GET.copy()
+    stream_query.pop("after", None)
+    for name in filters.errors:
+        stream_query.pop(name, None)
+    stream_query["since"] = last_change_id
+    stream_url = reverse("restaurateur:stream_orders")
+    return render(request, "order_items.html", {
+        "order_infos": get_order_infos(orders),
+        "filters": filters,
+        "next_page_url": next_page_url,
+        "first_page_url": first_page_url,
+        "stream_url": f"{stream_url}?{stream_query.urlencode()}",
+        # The stream is filtered too, but only the first page has room for new orders
+        "insert_new_orders": not filters.cleaned_data.get("after"),
+    })
+
+
+def format_event(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+def get_order_changes(last_change_id, limit, orders=None, seen_change_ids=()):
+    """Orders changed after the given OrderChange id.
+
+    The recent changes up to the id are read again, except the ones in
+    seen_change_ids. Returns the id of the last change read, ids of the
+    changes read, infos of the changed orders that are still among
+    `orders` (all open orders by default) and ids of the orders gone from
+    them.
+    """
+    changes = list(
+        OrderChange.objects.filter(id__gt=last_change_id)
+        .order_by("id")
+        .values_list("id", "order_id")[:limit]
+    )
+    late_changes = (
+        OrderChange.objects
+        .filter(
+            id__lte=last_change_id,
+            changed_at__gte=timezone.now() - ORDER_CHANGES_REREAD_WINDOW,
+        )
+        .values_list("id", "order_id")
+    )
+    changes.extend(
+        (change_id, order_id) for change_id, order_id in late_changes
+        if change_id not in seen_change_ids
+    )
+    if not changes:
+        return last_change_id, [], [], []
+
+    last_change_id = max(last_change_id, *(change_id for change_id, _ in changes))
+    order_ids = {order_id for _, order_id in changes}
+    if orders is None:
+        orders = get_open_orders()
+    orders = list(orders.filter(id__in=order_ids).order_by("-id"))
+    removed_ids = sorted(order_ids - {order.id for order in orders})
+    return (
+        last_change_id,
+        [change_id for change_id, _ in changes],
+        get_order_infos(orders),
+        removed_ids,
+    )
+
+
+def is_order_change_pruned(last_change_id):
+    """If the changes following the id may have been pruned already."""
+    first_change_id = (
+        OrderChange.objects.order_by("id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    return first_change_id is not None and last_change_id < first_change_id - 1
+
+
+def iter_order_events(last_change_id, orders):
+    # Ask the browser to reconnect quickly when the stream ends
+    yield "retry: 1000\n\n"
+    if is_order_change_pruned(last_change_id):
+        yield format_event("reload", {}, get_last_order_change_id())
+        return
+
+    # Ids of the changes sent lately, by the time they were read
+    sent_change_ids = {}
+    started_at = last_sent_at = time.monotonic()
+    while time.monotonic() - started_at < ORDER_STREAM_DURATION:
+        last_change_id, change_ids, order_infos, removed_ids = get_order_changes(
+            last_change_id, ORDER_STREAM_BATCH_SIZE, orders, sent_change_ids,
+        )
+        read_at = time.monotonic()
+        sent_change_ids.update(dict.fromkeys(change_ids, read_at))
+        window_start = read_at - 2 * ORDER_CHANGES_REREAD_WINDOW.total_seconds()
+        sent_change_ids = {
+            change_id: sent_at for change_id, sent_at in sent_change_ids.items()
+            if sent_at > window_start
+        }
+
+        if order_infos or removed_ids:
+            for info in order_infos:
+                html = render_to_string("order_row.html", {"info": info}).strip()
+                yield format_event(
+                    "order",
+                    {"id": info["order"].id, "html": html},
+                    last_change_id,
+                )
+            for order_id in removed_ids:
+                yield format_event("removed", {"id": order_id}, last_change_id)
+            last_sent_at = time.monotonic()
+            if len(change_ids) >= ORDER_STREAM_BATCH_SIZE:
+                continue
+
+        if time.monotonic() - last_sent_at > ORDER_STREAM_KEEPALIVE_INTERVAL:
+            yield ": keepalive\n\n"
+            last_sent_at = time.monotonic()
+        time.sleep(ORDER_STREAM_POLL_INTERVAL)
+
+
+@user_passes_test(is_manager, login_url="restaurateur:login")
+def stream_orders(request):
+    """Changes of the orders matching the dashboard filters."""
+    filters = OrderFilters(request.GET)
+    if not filters.is_valid():
+        return HttpResponseBadRequest(filters.errors.as_text())
+
+    last_change_id = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        last_change_id = int(last_change_id)
+    except (TypeError, ValueError):
+        last_change_id = get_last_order_change_id()
+
+    response = StreamingHttpResponse(
+        iter_order_events(last_change_id, filters.filter_orders(get_open_orders())),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def serialize_restaurant_distance(restaurant, dist):
+    return {
+        "id": restaurant.id,
+        "name": restaurant.name,
+        "distance_km": dist,
+    }
+
+
+def serialize_order_info(info):
+    order = info["order"]
+    assigned = info["assigned_restaurant_info"]
+    return {
+        "id": order.id,
+        "status": order.status,
+        "payment_method": order.payment_method,
+        "total_price": order.total_price,
+        "firstname": order.firstname,
+        "lastname": order.lastname,
+        "phonenumber": str(order.phonenumber),
+        "address": order.address,
+        "comment": order.comment,
+        "registered_at": order.registered_at,
+        "geocode_error": info["geocode_error"],
+        "geocode_pending": info["geocode_pending"],
+        "version": order.version,
+        "manager": order.manager.get_username() if order.manager else None,
+        "claimed_at": order.claimed_at,
+        "restaurant": serialize_restaurant_distance(*assigned) if assigned else None,
+        "available_restaurants": [
+            serialize_restaurant_distance(restaurant, dist)
+            for restaurant, dist in info["available_restaurants"]
+        ],
+    }
+
+
+class OrderChangesForm(forms.Form):
+    since = forms.IntegerField(min_value=0, required=False)
+    after = forms.RegexField(regex=r"^[01]\.\d+$", required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get("after") and cleaned_data.get("since") is None:
+            raise forms.ValidationError(
+                "after подходит только к since из первой страницы",
+                code="invalid",
+            )
+        return cleaned_data
+
+
+@manager_api
+def order_changes_api(request):
+    """Orders changed since the client's cursor, all open orders page by page without it.
+
+    The first sync returns the cursor to poll from and the first page of
+    open orders, the next pages are asked with the same cursor as
+    ?since=<cursor>&after=<next>. Orders changed within the last seconds
+    may come again, the latest state wins. A cursor older than the kept
+    changes starts the sync over, with "reset" set.
+    """
+    form = OrderChangesForm(request.GET)
+    if not form.is_valid():
+        return FastJSONResponse({"error": form.errors.get_json_data()}, status=400)
+    since = form.cleaned_data["since"]
+    after = form.cleaned_data["after"]
+
+    reset = since is not None and is_order_change_pruned(since)
+    if reset:
+        # The pages read so far are as outdated as the cursor, start over
+        after = None
+    if since is None or after or reset:
+        cursor = since if after else get_last_order_change_id()
+        orders, next_page = get_orders_page(
+            get_open_orders(),
+            cursor=after,
+            page_size=ORDER_CHANGES_BATCH_SIZE,
+        )
+        order_infos = get_order_infos(orders)
+        removed_ids = []
+        has_more = False
+    else:
+        cursor, _, order_infos, removed_ids = get_order_changes(
+            since, ORDER_CHANGES_BATCH_SIZE,
+        )
+        next_page = None
+        has_more = OrderChange.objects.filter(id__gt=cursor).exists()
+
+    return FastJSONResponse(
+        {
+            "cursor": cursor,
+            "has_more": has_more,
+            "next": next_page,
+            "reset": reset,
+            "orders": [serialize_order_info(info) for info in order_infos],
+            "removed": removed_ids,
+        },
+    )
+
+
+class ClaimOrdersForm(forms.Form):
+    limit = forms.IntegerField(
+        min_value=1,
+        max_value=ORDER_CLAIM_MAX_BATCH_SIZE,
+        required=False,
+    )
+
+
+class ReleaseOrdersForm(forms.Form):
+    orders = forms.ModelMultipleChoiceField(queryset=Order.objects.all())
+
+
+class AssignRestaurantForm(forms.Form):
+    restaurant = forms.ModelChoiceField(queryset=Restaurant.objects.all())
+    version = forms.IntegerField(min_value=0)
+
+
+class InvalidRequestData(ValueError):
+    pass
+
+
+def get_request_data(request):
+    """Form data or the JSON object in the request body."""
+    if request.content_type != "application/json":
+        return request.POST
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        raise InvalidRequestData("Тело запроса — не JSON")
+    if not isinstance(data, dict):
+        raise InvalidRequestData("Тело запроса должно быть JSON-объектом")
+    return data
+
+
+def get_form_errors_response(form):
+    return FastJSONResponse(
+        {"error": form.errors.get_json_data()},
+        status=400,
+    )
+
+
+def get_orders_response(order_ids, status=200, **extra):
+    orders = list(get_open_orders().filter(id__in=order_ids).order_by("id"))
+    return FastJSONResponse(
+        {
+            "orders": [serialize_order_info(info) for info in get_order_infos(orders)],
+            **extra,
+        },
+        status=status,
+    )
+
+
+@require_POST
+@manager_api
+def claim_orders_api(request):
+    """Take a batch of unclaimed raw orders into work."""
+    try:
+        form = ClaimOrdersForm(get_request_data(request))
+    except InvalidRequestData as error:
+        return FastJSONResponse({"error": str(error)}, status=400)
+    if not form.is_valid():
+        return get_form_errors_response(form)
+    order_ids = claim_orders(request.user, form.cleaned_data["limit"] or ORDERS_PAGE_SIZE)
+    return get_orders_response(order_ids)
+
+
+@require_POST
+@manager_api
+def release_orders_api(request):
+    try:
+        form = ReleaseOrdersForm(get_request_data(request))
+    except InvalidRequestData as error:
+        return FastJSONResponse({"error": str(error)}, status=400)
+    if not form.is_valid():
+        return get_form_errors_response(form)
+    order_ids = release_orders(
+        request.user,
+        [order.id for order in form.cleaned_data["orders"]],
+    )
+    return get_orders_response(order_ids)
+
+
+@require_POST
+@manager_api
+def assign_restaurant_api(request, order_id):
+    """Assign a restaurant unless the order changed since the manager saw it."""
+    try:
+        form = AssignRestaurantForm(get_request_data(request))
+    except InvalidRequestData as error:
+        return FastJSONResponse({"error": str(error)}, status=400)
+    if not form.is_valid():
+        return get_form_errors_response(form)
+    try:
+        assign_restaurant(
+            order_id,
+            form.cleaned_data["restaurant"].id,
+            form.cleaned_data["version"],
+            request.user,
+        )
+    except OrderConflict:
+        return get_orders_response(
+            [order_id],
+            status=409,
+            error="Заказ уже изменил или взял в работу другой менеджер",
+        )
+    return get_orders_response([order_id])
+
 
-    return render(request, "order_items.html", {"order_infos": order_infos})
+@manager_api
+def geocoding_metrics_api(request):
+    """Geocoding counters, latencies and queue depth of all processes."""
+    return FastJSONResponse(get_metrics())
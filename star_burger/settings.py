@@ -5,6 +5,7 @@ from environs import Env
 
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 env = Env()
@@ -17,6 +18,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 SECRET_KEY = env('SECRET_KEY')
 DEBUG = env.bool('DEBUG', False)
 YANDEX_GEOCODER_API_KEY = os.getenv('YANDEX_GEOCODER_API_KEY')
+# Geocoders to ask in turn: the local gazetteer file, then Yandex
+GEOCODER_BACKENDS = env.list('GEOCODER_BACKENDS', default=['gazetteer', 'yandex'])
+# CSV or SQLite file with address, lat and lon of known addresses
+GEOCODER_GAZETTEER_PATH = env.str('GEOCODER_GAZETTEER_PATH', None)
+
+# Restaurants further than that are not offered to cook an order
+DELIVERY_RADIUS_KM = env.float('DELIVERY_RADIUS_KM', None)
+# How many nearest restaurants to offer for an order, all if not set
+ORDER_RESTAURANTS_LIMIT = env.int('ORDER_RESTAURANTS_LIMIT', None)
+# A manager's claim on an order lapses if it wasn't assigned in that time
+ORDER_CLAIM_TIMEOUT_MINUTES = env.int('ORDER_CLAIM_TIMEOUT_MINUTES', 15)
+# Dashboards that were offline longer than that reload all orders
+ORDER_CHANGES_RETENTION_DAYS = env.int('ORDER_CHANGES_RETENTION_DAYS', 7)
 
 
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', ['127.0.0.1', 'localhost'])
@@ -102,6 +116,28 @@ DATABASES = {
     )
 }
 
+# Must be shared by all gunicorn workers and the geocode worker: cached
+# catalog, menus, banners and indexes are invalidated through it. The
+# table of the default one is made by `manage.py createcachetable`.
+CACHES = {
+    'default': env.dj_cache_url('CACHE_URL', 'db://django_cache?max_entries=100000'),
+}
+if not DEBUG and CACHES['default']['BACKEND'] in [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]:
+    raise ImproperlyConfigured(
+        'CACHE_URL must point to a cache shared by all processes, '
+        'otherwise they serve stale data'
+    )
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'foodcartapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -12,3 +12,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "star_burger.settings")
 application = get_wsgi_application()
+
+# Apps are loaded only now, the geocoding counters of requests are sent
+# to the shared cache from here on
+from foodcartapp.services.geocode_metrics import start_flushing  # noqa: E402
+
+start_flushing()